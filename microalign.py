@@ -3,13 +3,14 @@
 
 import argparse
 
-from microlib.aligner import bowtie, htseq
+from microlib.aligner import bowtie, bowtie_count, htseq
+from microlib.counter import CACHE_DIR
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
     "--aligner",
-    help="select the aligner [bowtie, bowtie_htseq]",
-    choices=["bowtie", "bowtie_htseq"],
+    help="select the aligner [bowtie, bowtie_htseq, bowtie_count]",
+    choices=["bowtie", "bowtie_htseq", "bowtie_count"],
     default="bowtie_htseq",
 )
 parser.add_argument(
@@ -18,6 +19,11 @@ parser.add_argument(
     default="data/GCA_000001405.15_GRCh38_no_alt_analysis_set.fna.bowtie_index",
 )
 parser.add_argument("--gff", help="specify the gff file", default="data/hsa.gff3")
+parser.add_argument(
+    "--gff-cache",
+    help="directory caching the parsed gff index of bowtie_count (empty disables)",
+    default=CACHE_DIR,
+)
 parser.add_argument("-o", "--out-name", help="output name", required=True)
 # parser.add_argument("--sam", help="specify the sam file", default="data/eg2.sam")
 # parser.add_argument(
@@ -51,6 +57,10 @@ def main():
         args.count = f"{args.out_name}.tsv"
         htseq(args)
 
+    if args.aligner == "bowtie_count":
+        args.count = f"{args.out_name}.tsv"
+        bowtie_count(args)
+
 
 if __name__ == "__main__":
     main()
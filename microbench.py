@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from fastqandfurious import fastqandfurious as ff
+from fastqandfurious._fastqandfurious import entrypos as entrypos_c
+
+import microtrim
+from microlib.synth import read_truth, score_cuts, simulate
+from microlib.matcher import qgram
+from microtrim import MATCHER_BUILDER, PREFILTERED, match_lines, trim_partition
+
+parser = argparse.ArgumentParser(
+    description="time every matcher and the trimming kernel in process"
+)
+parser.add_argument(
+    "-m",
+    "--matcher",
+    nargs="+",
+    help=f"the matchers to time (default all) [{', '.join(MATCHER_BUILDER)}]",
+    choices=list(MATCHER_BUILDER),
+    default=list(MATCHER_BUILDER),
+)
+parser.add_argument(
+    "-i", "--in-file", help="FASTQ file of the reads (default synthetic reads)"
+)
+parser.add_argument(
+    "--truth",
+    help="true cut positions of the reads of the input file (see microsynth.py), "
+    "to score the matchers",
+)
+parser.add_argument(
+    "--tolerance",
+    type=int,
+    help="bases between a right and the true cut position",
+    default=0,
+)
+parser.add_argument("--reads", type=int, help="number of reads to time", default=2000)
+parser.add_argument("--seed", type=int, help="seed of the synthetic reads", default=1)
+parser.add_argument(
+    "--repeat", type=int, help="runs of every benchmark (the best is kept)", default=3
+)
+parser.add_argument("--chunk", type=int, help="reads in every partition", default=500)
+parser.add_argument("-o", "--out-file", help="save the results to this JSON file")
+parser.add_argument(
+    "--baseline", help="compare the results with this JSON file of a previous run"
+)
+parser.add_argument(
+    "--trim-args",
+    help="microtrim arguments used to build the matchers (e.g. '--match-only 13')",
+    default="",
+)
+
+
+def fastq_reads(inFilePath, count):
+    """
+    Return the names and the sequences of the first count reads of a FASTQ
+    file
+    """
+    with open(inFilePath, "rb") as infile:
+        sequence = ff.readfastq_iter(infile, fbufsize=50000, _entrypos=entrypos_c)
+        records = [seq for seq, _ in zip(sequence, range(count))]
+    return [seq[0] for seq in records], [seq[1] for seq in records]
+
+
+def timed(fun, repeat):
+    """
+    Return the best time (seconds) of repeat calls of fun and the peak of
+    the memory allocated by one more call
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        t_start = time.perf_counter()
+        fun()
+        best = min(best, time.perf_counter() - t_start)
+    tracemalloc.start()
+    fun()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def result(name, reads, seconds, peak, **extra):
+    return dict(
+        name=name,
+        reads=reads,
+        seconds=seconds,
+        reads_per_s=reads / seconds,
+        ns_per_read=1e9 * seconds / reads,
+        peak_bytes=peak,
+        **extra,
+    )
+
+
+def bench_matcher(name, reads, cuts, chunk, repeat, trimArgs, tolerance):
+    """
+    Time the matching of the reads, in partitions as in the workers, and
+    score the matches against the true cuts (if any)
+    """
+    args = microtrim.parser.parse_args(["-m", name] + trimArgs)
+    adapters = microtrim.read_adapters(args.adapter)
+    t_start = time.perf_counter()
+    matcher = MATCHER_BUILDER[name](adapters, args)
+    if args.prefilter and name in PREFILTERED:
+        matcher = qgram.build(matcher, args)
+    build = time.perf_counter() - t_start
+    partitions = [reads[i : i + chunk] for i in range(0, len(reads), chunk)]
+
+    def run():
+        for lines in partitions:
+            match_lines(lines, matcher)
+
+    seconds, peak = timed(run, repeat)
+    matches = [m for lines in partitions for m in match_lines(lines, matcher)]
+    extra = dict(build_ms=1000 * build, matched=sum(1 for m in matches if m))
+    if cuts is not None:
+        lengths = map(len, reads)
+        extra["precision"], extra["recall"] = score_cuts(
+            lengths, matches, cuts, tolerance
+        )
+    return result(name, len(reads), seconds, peak, **extra)
+
+
+def bench_kernel(reads, chunk, repeat, trimArgs):
+    """
+    Time trim_partition alone: the matches are computed in advance and
+    replayed by the match fun
+    """
+    args = microtrim.parser.parse_args(["-m", "adagen-fast-ac"] + trimArgs)
+    adapters = microtrim.read_adapters(args.adapter)
+    matcher = MATCHER_BUILDER["adagen-fast-ac"](adapters, args)
+    matches = dict(zip(reads, match_lines(reads, matcher)))
+    partitions = [
+        [(b"read%d" % i, line, b"I" * len(line)) for i, line in enumerate(lines)]
+        for lines in (reads[i : i + chunk] for i in range(0, len(reads), chunk))
+    ]
+
+    def replay(line):
+        return matches[line]
+
+    def replay_batch(lines):
+        return [matches[line] for line in lines]
+
+    replay.batch = replay_batch
+    trim = (args.trim_first, args.trim_last, args.trim_to)
+
+    def run():
+        for p in partitions:
+            trim_partition(p, *trim, replay, bytearray())
+
+    seconds, peak = timed(run, repeat)
+    return result("trim_partition", len(reads), seconds, peak)
+
+
+def print_result(r):
+    score = ""
+    if "precision" in r:
+        score = f" {100 * r['precision']:>9.2f}% {100 * r['recall']:>9.2f}%"
+    print(
+        f"{r['name']:<16} {r['reads_per_s']:>12.0f} {r['ns_per_read']:>12.0f} "
+        f"{r['peak_bytes'] / 1024:>10.1f}{score}"
+    )
+
+
+def compare(results, baselinePath):
+    """
+    Print the speed of the results relative to a baseline run
+    """
+    with open(baselinePath, "r") as baselineFile:
+        baseline = {r["name"]: r for r in json.load(baselineFile)["results"]}
+    print()
+    print(f"{'benchmark':<16} {'ns/read':>12} {'baseline':>12} {'speedup':>8}")
+    for r in results:
+        if r["name"] not in baseline:
+            continue
+        old = baseline[r["name"]]["ns_per_read"]
+        print(
+            f"{r['name']:<16} {r['ns_per_read']:>12.0f} {old:>12.0f} "
+            f"{old / r['ns_per_read']:>7.2f}x"
+        )
+
+
+def main():
+    args = parser.parse_args()
+    trimArgs = args.trim_args.split()
+    cuts = None
+    if args.in_file:
+        names, reads = fastq_reads(args.in_file, args.reads)
+        if args.truth:
+            truth = read_truth(args.truth)
+            cuts = [truth[name] for name in names]
+    else:
+        adapter = microtrim.parser.parse_args(["-m", "adagen"] + trimArgs).adapter[0]
+        records = list(simulate(args.reads, adapter, args.seed))
+        reads = [record[1] for record in records]
+        cuts = [record[3] for record in records]
+
+    results = []
+    print(
+        f"{'benchmark':<16} {'reads/s':>12} {'ns/read':>12} {'peak KiB':>10}"
+        + (f" {'precision':>10} {'recall':>10}" if cuts is not None else "")
+    )
+    for name in args.matcher:
+        results.append(
+            bench_matcher(
+                name, reads, cuts, args.chunk, args.repeat, trimArgs, args.tolerance
+            )
+        )
+        print_result(results[-1])
+    results.append(bench_kernel(reads, args.chunk, args.repeat, trimArgs))
+    print_result(results[-1])
+
+    if args.out_file:
+        report = {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "reads": args.in_file or f"synthetic (seed {args.seed})",
+            "trim_args": args.trim_args,
+            "results": results,
+        }
+        with open(args.out_file, "w") as outFile:
+            json.dump(report, outFile, indent=2)
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import socket
+import sys
+
+# as in microserver.py, without importing the matchers
+SOCKET_PATH = os.path.expanduser("~/.cache/microtrim/server.sock")
+
+parser = argparse.ArgumentParser(
+    description="send a trimming job to microserver.py, the other arguments are "
+    "the microtrim.py ones (e.g. -m adagen-fast-ac -i in.fastq -o out.fastq)"
+)
+parser.add_argument("--socket", help="path of the Unix socket", default=SOCKET_PATH)
+parser.add_argument(
+    "--stats-json",
+    help="write the time spent in every stage of every process to this JSON file",
+)
+parser.add_argument("--shutdown", help="stop the server", action="store_true")
+
+
+def main():
+    args, trimArgs = parser.parse_known_args()
+    if args.shutdown:
+        job = {"command": "shutdown"}
+    else:
+        job = {"args": trimArgs, "cwd": os.getcwd()}
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(args.socket)
+    except OSError as e:
+        sys.exit(f"Cannot connect to the server at {args.socket}: {e}")
+    client.sendall(json.dumps(job).encode() + b"\n")
+    status = 1
+    with client.makefile("rb") as events:
+        for line in events:
+            event = json.loads(line)
+            if event["event"] == "start":
+                if event["warm"]:
+                    pool = "warm pool"
+                else:
+                    pool = f"new pool built in {event['build_ms']:.0f} ms"
+                print(f"Job started in {event['start_ms']:.1f} ms ({pool})")
+            elif event["event"] == "progress":
+                print(f"Sent {event['reads']} reads", file=sys.stderr)
+            elif event["event"] == "error":
+                print(f"Error: {event['message']}", file=sys.stderr)
+            elif event["event"] == "done":
+                status = 0
+                stats = event.get("stats")
+                if stats:
+                    reads = sum(
+                        p["counts"].get("reads", 0)
+                        for p in stats["processes"]
+                        if p["name"] == "Reader"
+                    )
+                    print(
+                        f"Processed {reads} elements in {stats['matching_ms']:.0f} ms "
+                        f"({100 * stats['hit_rate']:.2f}% matched)"
+                    )
+                    if args.stats_json:
+                        with open(args.stats_json, "w") as statsFile:
+                            json.dump(stats, statsFile, indent=2)
+                        print(f"Stats written to {args.stats_json}")
+    client.close()
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
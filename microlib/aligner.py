@@ -3,7 +3,19 @@ import time
 import math
 import re
 import csv
-from subprocess import PIPE, run
+import sys
+from subprocess import (
+    DEVNULL,
+    PIPE,
+    CalledProcessError,
+    CompletedProcess,
+    Popen,
+    run,
+)
+from multiprocessing import Process
+from tempfile import TemporaryFile
+
+from microlib.counter import count_features
 
 
 def parse_bowtie2(out):
@@ -36,15 +48,18 @@ def parse_htseq(count_file):
     return 100 * aligned / total, 100 * bad_aligned / total, 100 * not_aligned / total
 
 
-def bowtie(args):
-    cmd = "bowtie2 -x {} {} -S {} -p {}" "".format(
-        args.index, args.in_file, args.sam, args.workers
-    )
-    t_start = time.perf_counter() * 1000
-    out = run(cmd, check=True, stdout=PIPE, stderr=PIPE, shell=True)
-    t_end = time.perf_counter() * 1000
+def bowtie_cmd(args, in_file, sam=True):
+    """
+    The bowtie2 command line, writing the alignments to args.sam or, if
+    not sam, to the standard output
+    """
+    cmd = "bowtie2 -x {} {} -p {}".format(args.index, in_file, args.workers)
+    if sam:
+        cmd += " -S {}".format(args.sam)
+    return cmd
 
-    time_align = math.floor(t_end - t_start)
+
+def print_bowtie(out, time_align):
     count, aligned, not_aligned, ignored = parse_bowtie2(out)
     ignored = ignored / count * 100.0
 
@@ -57,22 +72,123 @@ def bowtie(args):
     print(f"- Not aligned: {not_aligned:2.2f}%")
 
 
-def htseq(args):
-    cmd = "python3 -m HTSeq.scripts.count -t miRNA -i Name {} {} > {}".format(
-        args.sam, args.gff, args.count
-    )
+def bowtie(args):
+    cmd = bowtie_cmd(args, args.in_file)
     t_start = time.perf_counter() * 1000
-    run(cmd, check=True, stdout=PIPE, stderr=PIPE, shell=True)
+    out = run(cmd, check=True, stdout=PIPE, stderr=PIPE, shell=True)
     t_end = time.perf_counter() * 1000
 
     time_align = math.floor(t_end - t_start)
-    aligned, bad_aligned, not_aligned = parse_htseq(args.count)
+    print_bowtie(out, time_align)
+
+
+def bowtie_stream(args, in_file="-U -", sam=True):
+    """
+    Start bowtie2, by default reading the reads from its standard input
+    (proc.stdin); if not sam the alignments are read from proc.stdout.
+    Finish it with bowtie_wait once the input is closed.
+    """
+    cmd = bowtie_cmd(args, in_file, sam)
+    err = TemporaryFile()
+    t_start = time.perf_counter() * 1000
+    proc = Popen(
+        cmd,
+        stdin=PIPE if in_file == "-U -" else None,
+        stdout=DEVNULL if sam else PIPE,
+        stderr=err,
+        shell=True,
+    )
+    return proc, err, t_start
+
+
+def bowtie_wait(proc, err, t_start):
+    returncode = proc.wait()
+    t_end = time.perf_counter() * 1000
+    err.seek(0)
+    out = CompletedProcess(proc.args, returncode, stderr=err.read())
+    err.close()
+    if returncode:
+        raise CalledProcessError(returncode, proc.args, stderr=out.stderr)
+
+    time_align = math.floor(t_end - t_start)
+    print_bowtie(out, time_align)
+
+
+def bowtie_abort(proc, err, t_start):
+    """
+    Stop bowtie2 (see bowtie_stream) after a failure of the trimming,
+    printing its errors
+    """
+    proc.kill()
+    proc.wait()
+    err.seek(0)
+    sys.stderr.write(err.read().decode("utf-8", "replace"))
+    err.close()
+
+
+def print_counts(name, count_file, time_align):
+    aligned, bad_aligned, not_aligned = parse_htseq(count_file)
 
     # Print results
     print()
-    print("HTSeq alignment")
+    print(name)
     print(f"- Alignment time: {time_align}")
     print(f"- Aligned: {aligned:2.2f}%")
     print(f"- Badly aligned: {bad_aligned:2.2f}%")
     print(f"- Not aligned: {not_aligned:2.2f}%")
     print()
+
+
+def htseq(args):
+    cmd = "python3 -m HTSeq.scripts.count -t miRNA -i Name {} {} > {}".format(
+        args.sam, args.gff, args.count
+    )
+    t_start = time.perf_counter() * 1000
+    run(cmd, check=True, stdout=PIPE, stderr=PIPE, shell=True)
+    t_end = time.perf_counter() * 1000
+
+    time_align = math.floor(t_end - t_start)
+    print_counts("HTSeq alignment", args.count, time_align)
+
+
+def count_fun(proc, gff, count, cacheDir):
+    if proc.stdin:
+        # do not keep the input of bowtie2 open
+        proc.stdin.close()
+    count_features(proc.stdout, gff, count, cacheDir)
+
+
+def count_start(proc, args):
+    """
+    Count in a separate process the alignments bowtie2 writes to its
+    standard output on the features of args.gff (see bowtie_stream),
+    writing them to args.count in the htseq-count format
+    """
+    t_start = time.perf_counter() * 1000
+    counter = Process(
+        target=count_fun, args=(proc, args.gff, args.count, args.gff_cache)
+    )
+    counter.start()
+    proc.stdout.close()
+    return counter, args.count, t_start
+
+
+def count_wait(counter, count_file, t_start):
+    counter.join()
+    t_end = time.perf_counter() * 1000
+    if counter.exitcode:
+        raise RuntimeError(f"feature counting failed ({counter.exitcode})")
+
+    time_align = math.floor(t_end - t_start)
+    print_counts("Feature counting", count_file, time_align)
+
+
+def bowtie_count(args):
+    """
+    Align with bowtie2 and count the alignments on the features while
+    they are streamed from its standard output, without a SAM file
+    """
+    aligner = bowtie_stream(args, args.in_file, sam=False)
+    counting = count_start(aligner[0], args)
+    bowtie_wait(*aligner)
+    count_wait(*counting)
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from collections import Counter
+
+
+def count_partition(partition, counts):
+    """
+    Add the sequences of a partition of reads to a table of counts
+    """
+    counts.update(seq[1] for seq in partition)
+    return counts
+
+
+def merge_tables(tables):
+    """
+    Merge partial tables of counts (e.g. one for each worker)
+    """
+    counts = Counter()
+    for table in tables:
+        counts.update(table)
+    return counts
+
+
+def write_collapsed(outFile, counts, fmt="fasta"):
+    """
+    Write a table of counts of trimmed sequences, most frequent first, to
+    a binary file. The fasta format uses the `>seq_<rank>_x<count>`
+    headers, the tsv format has a `sequence<TAB>count` row for each
+    sequence. Empty sequences are not written.
+    """
+    rows = sorted(counts.items(), key=lambda row: (-row[1], row[0]))
+    for i, (seq, count) in enumerate(rows, 1):
+        if not seq:
+            continue
+        if fmt == "fasta":
+            outFile.write(b">seq_%d_x%d\n%b\n" % (i, count, seq))
+        else:
+            outFile.write(b"%b\t%d\n" % (seq, count))
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+import gzip
+import os
+import struct
+import zlib
+from collections import deque
+from functools import partial
+from multiprocessing import Pool, Process
+
+GZIP_MAGIC = b"\x1f\x8b"
+# uncompressed bytes in a BGZF block, as in bgzip
+BGZF_BLOCK_SIZE = 0xFF00
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+BATCH_BLOCKS = 64
+READ_SIZE = 1 << 20
+
+
+def is_gzip(inFilePath):
+    with open(inFilePath, "rb") as infile:
+        return infile.read(2) == GZIP_MAGIC
+
+
+def bgzf_block_size(header):
+    """
+    Return the size of the BGZF block starting with the given 18 bytes
+    header, or None if it is not a BGZF block
+    """
+    if len(header) < 18 or header[:4] != b"\x1f\x8b\x08\x04":
+        return None
+    xlen, si1, si2, slen, bsize = struct.unpack("<H2BHH", header[10:18])
+    if (si1, si2, slen) != (66, 67, 2):
+        return None
+    return bsize + 1
+
+
+def is_bgzf(inFilePath):
+    with open(inFilePath, "rb") as infile:
+        return bgzf_block_size(infile.read(18)) is not None
+
+
+def iter_bgzf_blocks(infile):
+    """
+    Yield the compressed blocks of a BGZF file
+    """
+    while True:
+        header = infile.read(18)
+        if not header:
+            return
+        size = bgzf_block_size(header)
+        if size is None:
+            raise ValueError("invalid BGZF block")
+        yield header + infile.read(size - 18)
+
+
+def inflate_blocks(blocks):
+    return b"".join(zlib.decompress(block, 31) for block in blocks)
+
+
+def deflate_blocks(data, level):
+    """
+    Compress data in a sequence of BGZF blocks
+    """
+    out = bytearray()
+    for start in range(0, len(data), BGZF_BLOCK_SIZE):
+        piece = data[start : start + BGZF_BLOCK_SIZE]
+        deflate = zlib.compressobj(level, zlib.DEFLATED, -15)
+        cdata = deflate.compress(piece) + deflate.flush()
+        out += struct.pack(
+            "<4BI2BH2BHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(cdata) + 25
+        )
+        out += cdata
+        out += struct.pack("<2I", zlib.crc32(piece), len(piece))
+    return bytes(out)
+
+
+def batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def pipeline(pool, fun, tasks, depth):
+    """
+    Yield fun(task) for every task, in order, computing up to depth tasks
+    ahead in the pool
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(fun, (task,)))
+        if len(pending) >= depth:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def gunzip_to_fd(inFilePath, fd):
+    with gzip.open(inFilePath, "rb") as infile, os.fdopen(fd, "wb") as pipe:
+        for data in iter(partial(infile.read, READ_SIZE), b""):
+            pipe.write(data)
+
+
+class ChunkReader:
+    """
+    File-like object reading from an iterator of chunks of bytes; read(n)
+    only returns less than n bytes at the end of the stream
+    """
+
+    def __init__(self, chunks, cleanup=()):
+        self.chunks = chunks
+        self.cleanup = cleanup
+        self.buffer = b""
+        self.pos = 0
+
+    def read(self, size=-1):
+        available = len(self.buffer) - self.pos
+        while size < 0 or available < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer = self.buffer[self.pos :] + chunk
+            self.pos = 0
+            available = len(self.buffer)
+        if size < 0 or size > available:
+            size = available
+        data = self.buffer[self.pos : self.pos + size]
+        self.pos += size
+        return data
+
+    def close(self):
+        for fun in self.cleanup:
+            fun()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_input(inFilePath, threads):
+    """
+    Open an input file for reading, decompressing it if gzipped: BGZF
+    blocks are decompressed in parallel by a pool of threads processes,
+    other gzip files are streamed from a helper process
+    """
+    if not is_gzip(inFilePath):
+        return open(inFilePath, "rb")
+    if threads <= 0:
+        return gzip.open(inFilePath, "rb")
+    if is_bgzf(inFilePath):
+        infile = open(inFilePath, "rb")
+        pool = Pool(threads)
+        tasks = batches(iter_bgzf_blocks(infile), BATCH_BLOCKS)
+        chunks = pipeline(pool, inflate_blocks, tasks, 2 * threads)
+        return ChunkReader(chunks, (pool.terminate, infile.close))
+    r, w = os.pipe()
+    helper = Process(target=gunzip_to_fd, args=(inFilePath, w))
+    helper.start()
+    os.close(w)
+    pipe = os.fdopen(r, "rb")
+    chunks = iter(partial(pipe.read, READ_SIZE), b"")
+    return ChunkReader(chunks, (helper.terminate, helper.join, pipe.close))
+
+
+class BgzfWriter:
+    """
+    File-like object writing a BGZF (block gzip) file, compressing batches
+    of blocks in parallel in a pool of threads processes
+    """
+
+    def __init__(self, outFilePath, threads, level=6):
+        self.outFile = open(outFilePath, "wb")
+        self.threads = threads
+        self.level = level
+        self.pool = Pool(threads) if threads > 0 else None
+        self.pending = deque()
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        size = BGZF_BLOCK_SIZE * BATCH_BLOCKS
+        while len(self.buffer) >= size:
+            self.submit(bytes(self.buffer[:size]))
+            del self.buffer[:size]
+
+    def submit(self, data):
+        if self.pool is None:
+            self.outFile.write(deflate_blocks(data, self.level))
+            return
+        self.pending.append(self.pool.apply_async(deflate_blocks, (data, self.level)))
+        if len(self.pending) > 2 * self.threads:
+            self.outFile.write(self.pending.popleft().get())
+
+    def close(self):
+        if self.buffer:
+            self.submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        while self.pending:
+            self.outFile.write(self.pending.popleft().get())
+        self.outFile.write(BGZF_EOF)
+        self.outFile.close()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_output(outFilePath, threads):
+    """
+    Open an output file for writing, as BGZF if its name ends with .gz
+    """
+    if outFilePath.endswith(".gz"):
+        return BgzfWriter(outFilePath, threads)
+    return open(outFilePath, "wb")
+
+
+class TeeWriter:
+    """
+    File-like object writing the same data to several outputs
+    """
+
+    def __init__(self, outFiles):
+        self.outFiles = outFiles
+
+    def write(self, data):
+        for outFile in self.outFiles:
+            outFile.write(data)
+
+    def close(self):
+        for outFile in self.outFiles:
+            outFile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_sink(outFilePath, threads, pipe=None):
+    """
+    Open the output file (if any, see open_output) and/or a pipe for
+    writing the same data
+    """
+    outFiles = [open_output(outFilePath, threads)] if outFilePath else []
+    if pipe is not None:
+        outFiles.append(pipe)
+    if len(outFiles) == 1:
+        return outFiles[0]
+    return TeeWriter(outFiles)
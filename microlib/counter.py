@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+# Counters written after the features, as in htseq-count
+SPECIAL = (
+    "__no_feature",
+    "__ambiguous",
+    "__too_low_aQual",
+    "__not_aligned",
+    "__alignment_not_unique",
+)
+CIGAR_RE = re.compile(rb"([0-9]+)([MIDNSHP=X])")
+MIN_QUAL = 10
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "microtrim")
+# rows of the cached index, every row contiguous for np.searchsorted
+GROUP, START, END, FID = range(4)
+# format of the cached index, part of its key
+INDEX_VERSION = 2
+
+
+def read_gff(gffPath, featureType="miRNA", idAttr="Name"):
+    """
+    Parse the features of the given type of a GFF file and return them as
+    a list of (chrom, strand, start, end, id) with 0-based, half-open
+    intervals
+    """
+    features = []
+    attr_re = re.compile(r"(?:^|;)\s*" + re.escape(idAttr) + r'[= ]"?([^";]+)')
+    with open(gffPath, "r") as gffFile:
+        for line in gffFile:
+            if line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 9 or fields[2] != featureType:
+                continue
+            m = attr_re.search(fields[8])
+            if not m:
+                continue
+            features.append(
+                (fields[0], fields[6], int(fields[3]) - 1, int(fields[4]), m.group(1))
+            )
+    return features
+
+
+def build_index(features):
+    """
+    Build an interval index of the features: for every (chrom, strand),
+    as bytes, the arrays of the starts, ends and id positions sorted by
+    start, plus the length of the longest feature and the sorted list of
+    all the ids
+    """
+    ids = sorted(set(fid for *_, fid in features))
+    position = {fid: i for i, fid in enumerate(ids)}
+    grouped = defaultdict(list)
+    for chrom, strand, start, end, fid in features:
+        grouped[(chrom.encode("utf-8"), strand.encode("utf-8"))].append(
+            (start, end, fid)
+        )
+    intervals = {}
+    for key, values in grouped.items():
+        values.sort()
+        starts, ends, fids = zip(*values)
+        intervals[key] = (
+            np.array(starts, dtype=np.int64),
+            np.array(ends, dtype=np.int64),
+            np.array([position[fid] for fid in fids], dtype=np.int64),
+        )
+    maxLen = max((end - start for _, _, start, end, _ in features), default=0)
+    return intervals, maxLen, ids
+
+
+def cache_path(cacheDir, gffPath, featureType, idAttr):
+    """
+    Path (without extension) of the cached index of a GFF file, keyed by
+    its path, modification time and size, by the feature type and id
+    attribute and by INDEX_VERSION
+    """
+    st = os.stat(gffPath)
+    key = "\t".join(
+        map(
+            str,
+            (
+                os.path.abspath(gffPath),
+                st.st_mtime_ns,
+                st.st_size,
+                featureType,
+                idAttr,
+                INDEX_VERSION,
+            ),
+        )
+    )
+    return os.path.join(cacheDir, "gff-" + hashlib.sha1(key.encode()).hexdigest())
+
+
+def save_index(path, index):
+    """
+    Save an index as a memory-mappable .npy array of 4 rows (GROUP, START,
+    END and FID of every feature) and a .json file with the groups, the
+    ids and maxLen
+    """
+    intervals, maxLen, ids = index
+    groups = sorted(intervals)
+    rows = np.zeros((4, sum(len(intervals[g][0]) for g in groups)), dtype=np.int64)
+    i = 0
+    for group, key in enumerate(groups):
+        starts, ends, fids = intervals[key]
+        block = rows[:, i : i + len(starts)]
+        block[GROUP] = group
+        block[START] = starts
+        block[END] = ends
+        block[FID] = fids
+        i += len(starts)
+    meta = {
+        "groups": [[chrom.decode(), strand.decode()] for chrom, strand in groups],
+        "ids": ids,
+        "maxLen": maxLen,
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write and rename, concurrent runs never see partial files
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as npyFile:
+        np.save(npyFile, rows)
+    os.replace(tmp, f"{path}.npy")
+    with open(tmp, "w") as jsonFile:
+        json.dump(meta, jsonFile)
+    os.replace(tmp, f"{path}.json")
+
+
+def load_index(path):
+    """
+    Load an index saved with save_index, memory-mapping its rows: the
+    columns of every (chrom, strand) are views of the mapped file, only
+    the pages searched by overlapping are read
+    """
+    with open(f"{path}.json", "r") as jsonFile:
+        meta = json.load(jsonFile)
+    rows = np.load(f"{path}.npy", mmap_mode="r")
+    if rows.ndim != 2 or len(rows) != 4:
+        raise ValueError(f"invalid index {path}.npy")
+    bounds = np.searchsorted(rows[GROUP], np.arange(len(meta["groups"]) + 1))
+    intervals = {}
+    for group, (chrom, strand) in enumerate(meta["groups"]):
+        block = np.asarray(rows[:, bounds[group] : bounds[group + 1]])
+        intervals[(chrom.encode(), strand.encode())] = (
+            block[START],
+            block[END],
+            block[FID],
+        )
+    return intervals, meta["maxLen"], meta["ids"]
+
+
+def cached_index(gffPath, featureType="miRNA", idAttr="Name", cacheDir=CACHE_DIR):
+    """
+    Return the index of the features of a GFF file, loading it from the
+    cache directory if already built (no cache if cacheDir is empty)
+    """
+    if not cacheDir:
+        return build_index(read_gff(gffPath, featureType, idAttr))
+    path = cache_path(cacheDir, gffPath, featureType, idAttr)
+    try:
+        return load_index(path)
+    except (OSError, ValueError, KeyError):
+        pass
+    index = build_index(read_gff(gffPath, featureType, idAttr))
+    try:
+        save_index(path, index)
+    except OSError as e:
+        print(f"Cannot cache the GFF index: {e}")
+    return index
+
+
+def overlapping(index, chrom, strand, start, end):
+    """
+    Return the set of ids of the features overlapping [start, end)
+    """
+    intervals, maxLen, ids = index
+    if (chrom, strand) not in intervals:
+        return set()
+    starts, ends, fids = intervals[(chrom, strand)]
+    first, last = np.searchsorted(starts, (start - maxLen, end))
+    hits = fids[first:last][ends[first:last] > start]
+    return {ids[fid] for fid in hits.tolist()}
+
+
+def count_sam(lines, index, minQual=MIN_QUAL):
+    """
+    Count the alignments of a SAM stream (lines as bytes) on the features,
+    as htseq-count does in union, stranded mode
+    """
+    counts = Counter({fid: 0 for fid in index[2]})
+    for key in SPECIAL:
+        counts[key] = 0
+    for line in lines:
+        if line.startswith(b"@"):
+            continue
+        fields = line.rstrip(b"\n").split(b"\t")
+        flag = int(fields[1])
+        if flag & 0x900:
+            # secondary and supplementary alignments
+            continue
+        if flag & 4:
+            counts["__not_aligned"] += 1
+            continue
+        nh = [f for f in fields[11:] if f.startswith(b"NH:i:")]
+        if nh and int(nh[0][5:]) > 1:
+            counts["__alignment_not_unique"] += 1
+            continue
+        if int(fields[4]) < minQual:
+            counts["__too_low_aQual"] += 1
+            continue
+        chrom = fields[2]
+        strand = b"-" if flag & 16 else b"+"
+        pos = int(fields[3]) - 1
+        found = set()
+        for size, op in CIGAR_RE.findall(fields[5]):
+            size = int(size)
+            if op in b"M=X":
+                found |= overlapping(index, chrom, strand, pos, pos + size)
+            if op in b"MDN=X":
+                pos += size
+        if not found:
+            counts["__no_feature"] += 1
+        elif len(found) > 1:
+            counts["__ambiguous"] += 1
+        else:
+            counts[found.pop()] += 1
+    return counts
+
+
+def write_counts(countPath, counts, index):
+    """
+    Write the counts in the htseq-count format
+    """
+    with open(countPath, "w") as countFile:
+        for fid in index[2]:
+            countFile.write(f"{fid}\t{counts[fid]}\n")
+        for key in SPECIAL:
+            countFile.write(f"{key}\t{counts[key]}\n")
+
+
+def count_features(samFile, gffPath, countPath, cacheDir=CACHE_DIR):
+    """
+    Count the alignments read from a SAM file object (binary, e.g. the
+    stdout of bowtie2) on the miRNA features of the GFF file
+    """
+    index = cached_index(gffPath, cacheDir=cacheDir)
+    counts = count_sam(samFile, index)
+    write_counts(countPath, counts, index)
+    return counts
@@ -3,6 +3,8 @@ Brute-force adapter matcher
 '''
 import time
 
+from microlib.matcher import automaton, multi, variants
+
 VERBOSE = False
 BASES = ('A', 'C', 'G', 'T')
 
@@ -54,16 +56,46 @@ def makeAdapters(adapter, matchOnly):
     return adapters
 
 
-def build(adapter, args):
+def mergeAdapters(adapters, args):
+    if args.edits is None:
+        variantSets = (
+            makeAdapters(adapter[:args.match_only], args.match_only)
+            for adapter in adapters)
+    else:
+        variantSets = (
+            variants.load_variants(
+                adapter, args.edits, args.match_only, args.variant_cache)
+            for adapter in adapters)
+    return multi.merge_variants(variantSets)
+
+
+def build(adapters, args):
     '''
     Build a brute force adapter macher with parameters:
       - match_only
+      - edits (up to edits substitutions, insertions or deletions in the
+        first match_only bases, instead of the default variants)
+      - variant_cache
+
+    The variants of all the adapters are searched in a single sorted list.
     '''
-    adapter = adapter[:args.match_only]
-    adapters = sorted(makeAdapters(adapter, args.match_only))
+    patterns, owner = mergeAdapters(adapters, args)
 
-    def match(line):
-        for adapter in adapters:
+    def find(line):
+        for adapter in patterns:
             if adapter in line:
-                return line.find(adapter)
-    return match
+                return line.find(adapter), owner[adapter]
+    return multi.counted(adapters, find)
+
+
+def build_ac(adapters, args):
+    '''
+    Build an Aho-Corasick adapter macher over the same variants with
+    parameters:
+      - match_only
+      - edits
+      - variant_cache
+    '''
+    patterns, owner = mergeAdapters(adapters, args)
+    find = automaton.build(patterns, [owner[pattern] for pattern in patterns])
+    return multi.counted(adapters, find)
@@ -3,6 +3,8 @@ Faster brute-force adapter matcher
 '''
 import time
 
+from microlib.matcher import automaton, multi, variants
+
 VERBOSE = False
 BASES = ('A', 'C', 'G', 'T')
 
@@ -31,14 +33,37 @@ def makeAdapters(adapter):
     return adapters
 
 
-def build(adapter, _):
+def mergeAdapters(adapters, args):
+    if args.edits is None:
+        return multi.merge_variants(map(makeAdapters, adapters))
+    return multi.merge_variants(
+        variants.load_variants(
+            adapter, args.edits, args.match_only, args.variant_cache)
+        for adapter in adapters)
+
+
+def build(adapters, args):
     '''
-    Build a brute force adapter macher with no parameters
+    Build a brute force adapter macher with no parameters, unless edits is
+    given: then the variants have up to edits substitutions, insertions or
+    deletions in the first match_only bases (see adaptergen)
+
+    The variants of all the adapters are searched in a single sorted list.
     '''
-    adapters = sorted(makeAdapters(adapter))
+    patterns, owner = mergeAdapters(adapters, args)
 
-    def match(line):
-        for adapter in adapters:
+    def find(line):
+        for adapter in patterns:
             if adapter in line:
-                return line.find(adapter)
-    return match
+                return line.find(adapter), owner[adapter]
+    return multi.counted(adapters, find)
+
+
+def build_ac(adapters, args):
+    '''
+    Build an Aho-Corasick adapter macher over the same variants with no
+    parameters (unless edits is given, as in build)
+    '''
+    patterns, owner = mergeAdapters(adapters, args)
+    find = automaton.build(patterns, [owner[pattern] for pattern in patterns])
+    return multi.counted(adapters, find)
@@ -0,0 +1,84 @@
+'''
+Aho-Corasick automaton for multi-pattern adapter matching
+'''
+
+
+def compile_patterns(patterns):
+    '''
+    Compile a list of patterns into a deterministic Aho-Corasick automaton.
+
+    The position of a pattern in the list is its rank: when several
+    patterns occur in a line the one with the lowest rank wins.
+    Returns (delta, rank, length), where for every state:
+      - delta[state] maps a character to the next state
+      - rank[state] is the lowest rank of the patterns ending in that
+        state (len(patterns) if none)
+      - length[state] is the length of that pattern
+    '''
+    none = len(patterns)
+    goto = [{}]
+    rank = [none]
+    length = [0]
+
+    # Trie of the patterns
+    for r, pattern in enumerate(patterns):
+        state = 0
+        for char in pattern:
+            if char not in goto[state]:
+                goto.append({})
+                rank.append(none)
+                length.append(0)
+                goto[state][char] = len(goto) - 1
+            state = goto[state][char]
+        if r < rank[state]:
+            rank[state] = r
+            length[state] = len(pattern)
+
+    # Failure links in breadth-first order, folding the outputs of the
+    # failure state into every state and completing the transitions
+    alphabet = set(char for pattern in patterns for char in pattern)
+    delta = [None] * len(goto)
+    delta[0] = {char: goto[0].get(char, 0) for char in alphabet}
+    queue = []
+    for char, state in goto[0].items():
+        queue.append((state, 0))
+    for state, fail in queue:
+        if rank[fail] < rank[state]:
+            rank[state] = rank[fail]
+            length[state] = length[fail]
+        delta[state] = dict(delta[fail])
+        for char, nextState in goto[state].items():
+            delta[state][char] = nextState
+            queue.append((nextState, delta[fail][char]))
+
+    return delta, rank, length
+
+
+def build(patterns, labels):
+    '''
+    Build a matcher returning the position of the first occurrence of the
+    lowest ranked pattern found in the line and the label of the pattern,
+    as the sequence
+      for pattern, label in zip(patterns, labels):
+          if pattern in line:
+              return line.find(pattern), label
+    would, but scanning the line only once.
+    '''
+    delta, rank, length = compile_patterns(patterns)
+    none = len(patterns)
+
+    def match(line):
+        state = 0
+        best = none
+        pos = None
+        for i, char in enumerate(line):
+            state = delta[state].get(char, 0)
+            if rank[state] < best:
+                best = rank[state]
+                pos = i + 1 - length[state]
+                if best == 0:
+                    break
+        if pos is not None:
+            return pos, labels[best]
+
+    return match
@@ -0,0 +1,65 @@
+'''
+Bounded LRU cache of match results
+'''
+from collections import OrderedDict
+
+from microlib.matcher import multi
+
+
+def build(match_fun, size):
+    '''
+    Wrap a matcher with a cache of the results (position and adapter) of
+    the last size distinct read sequences (least recently used eviction).
+    The batch entry point, if any, is wrapped too and only the missing
+    sequences are matched. The matches of every adapter are counted for
+    the cache hits too. match.info() returns the (hits, misses) count.
+    The filter_info of a prefiltered matcher (see qgram) is kept.
+    '''
+    cache = OrderedDict()
+    hits = 0
+    misses = 0
+
+    def store(line, value):
+        cache[line] = value
+        if len(cache) > size:
+            cache.popitem(last=False)
+
+    def find(line):
+        nonlocal hits, misses
+        if line in cache:
+            hits += 1
+            cache.move_to_end(line)
+            return cache[line]
+        misses += 1
+        value = match_fun.find(line)
+        store(line, value)
+        return value
+
+    def find_batch(lines):
+        nonlocal hits, misses
+        matches = [None] * len(lines)
+        missing = []
+        for i, line in enumerate(lines):
+            if line in cache:
+                cache.move_to_end(line)
+                matches[i] = cache[line]
+            else:
+                missing.append(i)
+        hits += len(lines) - len(missing)
+        misses += len(missing)
+        if missing:
+            values = batch([lines[i] for i in missing])
+            for i, value in zip(missing, values):
+                matches[i] = value
+                store(lines[i], value)
+        return matches
+
+    def info():
+        return hits, misses
+
+    batch = getattr(match_fun, "find_batch", None)
+    match = multi.counted(match_fun.adapters, find, find_batch if batch else None)
+    match.info = info
+    if hasattr(match_fun, 'filter_info'):
+        match.filter_info = match_fun.filter_info
+    return match
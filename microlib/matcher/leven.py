@@ -5,20 +5,32 @@ import math
 
 import Levenshtein
 
+from microlib.matcher import multi
 
-def build(adapter, args):
+
+def build(adapters, args):
     '''
     Build a Levenshtein matcher with parameters:
       - match_only
       - stop_after
+
+    All the adapters are tried at every offset, the first one matching at
+    the first offset wins.
+    match.find_windows(line, windows) tries only the offsets j of adapter
+    k with windows[k][j] true (see the qgram prefilter).
     '''
-    adapter = adapter[:args.match_only][::-1]
+    patterns = [adapter[:args.match_only][::-1] for adapter in adapters]
 
-    def match(line):
+    def find(line, windows=None):
         rline = line[::-1]
         for j, char in enumerate(rline[:math.floor(len(rline)/args.stop_after)]):
-            possibleMatch = rline[j:j+len(adapter)]
-            if Levenshtein.ratio(adapter, possibleMatch) >= 1-args.max_distance:
-                return -(j+len(adapter))
+            for k, adapter in enumerate(patterns):
+                if windows is not None and not windows[k][j]:
+                    continue
+                possibleMatch = rline[j:j+len(adapter)]
+                if Levenshtein.ratio(adapter, possibleMatch) >= 1-args.max_distance:
+                    return -(j+len(adapter)), k
 
+    match = multi.counted(adapters, find)
+    match.find_windows = find
     return match
@@ -0,0 +1,56 @@
+'''
+Multi-adapter matcher support
+'''
+
+
+def merge_variants(variantSets):
+    '''
+    Merge the sets of variants of several adapters in a single sorted list
+    of variants and a dict mapping every variant to the index of the first
+    adapter generating it
+    '''
+    owner = {}
+    for k, variants in enumerate(variantSets):
+        for variant in variants:
+            owner.setdefault(variant, k)
+    return sorted(owner), owner
+
+
+def counted(adapters, find, find_batch=None):
+    '''
+    Build a matcher from a find function returning the (position, adapter
+    index) of the match in a line, or None.
+    The matcher returns the position only and counts the matches of every
+    adapter, match.adapter_hits() returns the list of (adapter, matches).
+    If find_batch is given (the find results of a list of lines) the
+    matcher exposes it as match.batch.
+    match.adapters, match.find and match.find_batch are kept for the
+    wrappers rebuilding the matcher (e.g. the cache).
+    '''
+    hits = [0] * len(adapters)
+
+    def match(line):
+        found = find(line)
+        if found is None or not found[0]:
+            return None
+        hits[found[1]] += 1
+        return found[0]
+
+    def match_batch(lines):
+        matches = [None] * len(lines)
+        for i, found in enumerate(find_batch(lines)):
+            if found is not None and found[0]:
+                hits[found[1]] += 1
+                matches[i] = found[0]
+        return matches
+
+    def adapter_hits():
+        return list(zip(adapters, hits))
+
+    match.adapters = adapters
+    match.adapter_hits = adapter_hits
+    match.find = find
+    if find_batch:
+        match.find_batch = find_batch
+        match.batch = match_batch
+    return match
@@ -0,0 +1,159 @@
+'''
+Bit-parallel (Myers) edit distance matcher
+'''
+import math
+
+import numpy as np
+
+from microlib.matcher import multi
+from microlib.matcher.vector import pack
+
+# bits of the vectors of find_batch
+WORD = 64
+
+
+def build(adapters, args):
+    '''
+    Build a Myers bit-vector matcher with parameters:
+      - match_only
+      - stop_after
+      - max_distance
+
+    As in leven and ndleven the reversed adapter is searched in the
+    reversed read, but a single pass computes the edit distance of the
+    best alignment ending at every position. The first run of hits within
+    max_distance is taken and its best end is returned with the same
+    negative position convention.
+    The bit vectors of all the adapters advance together in the same pass:
+    the first adapter with a hit at the first position wins.
+    If every adapter prefix fits in a 64 bit word (match_only <= 64) the
+    matcher exposes match.batch(lines), which runs the same recurrence on
+    uint64 NumPy arrays with one lane per read of a partition; find is the
+    reference.
+    '''
+    patterns = [adapter[:args.match_only][::-1] for adapter in adapters]
+    lengths = [len(adapter) for adapter in patterns]
+    masks = [(1 << m) - 1 for m in lengths]
+    highs = [1 << (m - 1) for m in lengths]
+    maxErrors = [math.floor(args.max_distance * m) for m in lengths]
+    peqs = []
+    for adapter in patterns:
+        peq = {}
+        for i, char in enumerate(adapter):
+            peq[char] = peq.get(char, 0) | (1 << i)
+        peqs.append(peq)
+    longest = max(lengths)
+
+    def find(line):
+        rline = line[::-1]
+        windows = math.floor(len(rline) / args.stop_after)
+        pvs = list(masks)
+        mvs = [0] * len(patterns)
+        scores = list(lengths)
+        active = range(len(patterns))
+        hit = None
+        hitScore = None
+        for end, char in enumerate(rline[:windows + longest - 1], 1):
+            for k in active:
+                m = lengths[k]
+                if end > windows + m - 1:
+                    continue
+                mask = masks[k]
+                pv = pvs[k]
+                mv = mvs[k]
+                eq = peqs[k].get(char, 0)
+                xv = eq | mv
+                xh = (((eq & pv) + pv) ^ pv) | eq
+                ph = mv | (~(xh | pv) & mask)
+                mh = pv & xh
+                if ph & highs[k]:
+                    scores[k] += 1
+                elif mh & highs[k]:
+                    scores[k] -= 1
+                ph = (ph << 1) & mask
+                mh = (mh << 1) & mask
+                pvs[k] = mh | (~(xv | ph) & mask)
+                mvs[k] = ph & xv
+                score = scores[k]
+                if score <= maxErrors[k]:
+                    if hit is None:
+                        # the other adapters are not followed anymore
+                        active = (k,)
+                        hit = end
+                        hitScore = score
+                        break
+                    if score < hitScore:
+                        hit = end
+                        hitScore = score
+                elif hit is not None:
+                    return -hit, k
+        if hit is not None:
+            return -hit, active[0]
+
+    if longest > WORD:
+        return multi.counted(adapters, find)
+
+    one = np.uint64(1)
+    masks64 = [np.uint64(mask) for mask in masks]
+    highs64 = [np.uint64(high) for high in highs]
+    # peq of every byte
+    tables = []
+    for peq in peqs:
+        table = np.zeros(256, dtype=np.uint64)
+        for char, bits in peq.items():
+            table[ord(char)] = bits
+        tables.append(table)
+
+    def find_batch(lines):
+        if not lines:
+            return []
+        lanes = len(lines)
+        readLengths = np.fromiter((len(line) for line in lines), dtype=np.int64)
+        # reversed reads, left aligned
+        rlines = pack(lines, int(readLengths.max()))[:, ::-1]
+        windows = readLengths // args.stop_after
+        # last position followed for every adapter
+        ends = [np.minimum(windows + m - 1, readLengths) for m in lengths]
+        pvs = [np.full(lanes, mask, dtype=np.uint64) for mask in masks64]
+        mvs = [np.zeros(lanes, dtype=np.uint64) for _ in patterns]
+        scores = [np.full(lanes, m, dtype=np.int64) for m in lengths]
+        hit = np.zeros(lanes, dtype=np.int64)
+        hitScore = np.zeros(lanes, dtype=np.int64)
+        winner = np.zeros(lanes, dtype=np.int64)
+        done = np.zeros(lanes, dtype=bool)
+        for end in range(1, int(max(last.max() for last in ends)) + 1):
+            chars = rlines[:, end - 1]
+            for k in range(len(patterns)):
+                # the lanes still following adapter k at this position
+                active = ~done & (end <= ends[k]) & ((hit == 0) | (winner == k))
+                if not active.any():
+                    continue
+                mask = masks64[k]
+                pv = pvs[k]
+                mv = mvs[k]
+                eq = tables[k][chars]
+                xv = eq | mv
+                xh = (((eq & pv) + pv) ^ pv) | eq
+                ph = mv | (~(xh | pv) & mask)
+                mh = pv & xh
+                score = scores[k] + ((ph & highs64[k]) != 0) - ((mh & highs64[k]) != 0)
+                ph = (ph << one) & mask
+                mh = (mh << one) & mask
+                # an inactive lane never follows adapter k again
+                pvs[k] = mh | (~(xv | ph) & mask)
+                mvs[k] = ph & xv
+                scores[k] = score
+                within = active & (score <= maxErrors[k])
+                # a run of hits ends at the first position beyond maxErrors
+                done |= active & (hit > 0) & ~within
+                better = within & ((hit == 0) | (score < hitScore))
+                winner[better] = k
+                hit[better] = end
+                hitScore[better] = score[better]
+            if done.all():
+                break
+        return [
+            (-int(h), int(k)) if h else None for h, k in zip(hit.tolist(), winner)
+        ]
+
+    return multi.counted(adapters, find, find_batch)
@@ -0,0 +1,266 @@
+'''
+q-gram prefilter of the approximate matchers
+'''
+import math
+import re
+from bisect import bisect_left
+
+import numpy as np
+
+from microlib.matcher import multi
+from microlib.matcher.vector import pack
+
+ACGT = frozenset('ACGT')
+NOT_ACGT = re.compile('[^ACGT]')
+# 2 bit code of the bases, 4 for anything else
+CODES = np.full(256, 4, dtype=np.int64)
+for code, base in enumerate(b'ACGT'):
+    CODES[base] = code
+# slack of the float comparisons of the matchers
+EPS = 1e-9
+
+
+def grams(pattern, q):
+    return {pattern[i:i+q] for i in range(len(pattern) - q + 1)}
+
+
+def gram_codes(adapterGrams):
+    '''
+    Return the sorted array of the 2 bit codes of q-grams of ACGT
+    '''
+    codes = [
+        int(''.join(str('ACGT'.index(base)) for base in gram), 4)
+        for gram in adapterGrams
+    ]
+    return np.array(sorted(codes), dtype=np.int64)
+
+
+def finder(adapterGrams):
+    '''
+    Compile a regular expression finding the (overlapping) occurrences of
+    the q-grams
+    '''
+    return re.compile('(?=%s)' % '|'.join(sorted(adapterGrams)))
+
+
+def window_hits(m, q, maxEdits, cost):
+    '''
+    Return, for every window length w in [0, m], the least number of
+    q-grams of a window of a read that are q-grams of a pattern of length
+    m within maxEdits(w) edits of the window (q-gram lemma): an edit
+    touches at most cost q-grams of the pattern and the others are found
+    unchanged in the window.
+    '''
+    return [m - q + 1 - cost * maxEdits(w) for w in range(m + 1)]
+
+
+def best_q(adapter, maxEdits, cost):
+    '''
+    Return the q-gram length making the window filter of an adapter most
+    selective: the most q-grams needed beyond those expected by chance in
+    a random window
+    '''
+    m = len(adapter)
+
+    def margin(q):
+        need = window_hits(m, q, maxEdits, cost(q))[m]
+        return need - (m - q + 1) * len(grams(adapter, q)) / 4 ** q
+
+    return max(range(1, m + 1), key=margin)
+
+
+def min_run(m, minScore, penalty=2):
+    '''
+    Return the least length of a run of exact matches in a local alignment
+    of a pattern of length m scoring at least minScore (1 per match, at
+    least penalty per mismatch or gap): with e errors there are at least
+    minScore + penalty * e matches, split in at most e + 1 runs.
+    '''
+    maxErrors = (m - minScore) // penalty
+    return min(
+        math.ceil((minScore + penalty * e) / (e + 1)) for e in range(maxErrors + 1)
+    )
+
+
+def window_mask(rline, checks, stopAfter):
+    '''
+    Window filter of a reversed read: return, for every adapter, the list
+    of the offsets (booleans) whose window has enough q-gram hits
+    '''
+    n = len(rline)
+    stop = math.floor(n / stopAfter)
+    windows = []
+    for m, q, need, finditer, _ in checks:
+        mask = [False] * stop
+        starts = [hit.start() for hit in finditer(rline, 0, stop - 1 + m)]
+        # every window needs at least need[m] hits
+        if len(starts) >= need[m]:
+            for j in range(stop):
+                w = min(m, n - j)
+                if w < q:
+                    break
+                found = bisect_left(starts, j + w - q + 1) - bisect_left(starts, j)
+                mask[j] = found >= need[w]
+        windows.append(mask)
+    return windows
+
+
+def window_mask_batch(lines, checks, stopAfter):
+    '''
+    Vectorized window filter of a partition of reads: return the boolean
+    array (adapter, read, offset) of the windows with enough q-gram hits.
+    The hits of the reversed reads are summed along the reads and the hits
+    of every window are differences of the prefix sums.
+    '''
+    lengths = np.fromiter((len(line) for line in lines), dtype=np.int64)
+    width = int(lengths.max())
+    # reversed reads, left aligned and padded with 4
+    codes = CODES[pack(lines, width)[:, ::-1]]
+    stops = lengths // stopAfter
+    offsets = np.arange(int(stops.max()))
+    windows = np.zeros((len(checks), len(lines), len(offsets)), dtype=bool)
+    for a, (m, q, need, _, adapterCodes) in enumerate(checks):
+        count = width - q + 1
+        if count <= 0:
+            continue
+        gram = np.zeros((len(lines), count), dtype=np.int64)
+        other = np.zeros((len(lines), count), dtype=bool)
+        for k in range(q):
+            gram = 4 * gram + (codes[:, k:k + count] & 3)
+            other |= codes[:, k:k + count] == 4
+        hits = np.zeros((len(lines), count + 1), dtype=np.int64)
+        np.cumsum(np.isin(gram, adapterCodes) & ~other, axis=1, out=hits[:, 1:])
+        # window length and hits of every read and offset
+        w = np.clip(lengths[:, None] - offsets[None, :], 0, m)
+        ends = np.clip(offsets[None, :] + w - q + 1, 0, count)
+        starts = np.broadcast_to(np.minimum(offsets, count), ends.shape)
+        found = np.take_along_axis(hits, ends, 1) - np.take_along_axis(hits, starts, 1)
+        valid = (offsets[None, :] < stops[:, None]) & (w >= q)
+        windows[a] = valid & (found >= np.asarray(need)[w])
+    return windows
+
+
+def build(match_fun, args):
+    '''
+    Wrap an approximate matcher (leven, ndleven or ssw) with a filter that
+    rules out cheaply the reads, or the offsets in a read, that cannot
+    match, so that the matcher is called only on the surviving ones. The
+    results are the same.
+      - leven and ndleven: at every offset of the stop_after window the
+        reversed read window must share enough q-grams (length args.qgram,
+        or the most selective if None) with the reversed adapter prefix to
+        be within max_distance of it (q-gram lemma, a Damerau
+        transposition touching q+1 q-grams). The surviving offsets are
+        passed to match.find_windows; match.batch filters a whole
+        partition with NumPy.
+      - ssw: the alignment score needed by max_distance forces a run of
+        exact matches of a minimum length (pigeonhole), one of the
+        adapter substrings of that length must be in the reversed read;
+        reads with bases other than ACGT (which SSW aligns at no cost)
+        are always passed on
+    Adapters with bases other than ACGT disable the filter.
+    match.filter_info() returns the (rejected, checked) count of reads.
+    '''
+    patterns = [adapter[:args.match_only][::-1] for adapter in match_fun.adapters]
+    x = args.max_distance
+    rejected = 0
+    checked = 0
+    # None if every read can match
+    checks = None if any(not set(p) <= ACGT for p in patterns) else []
+
+    if args.matcher == 'ssw':
+        runs = set()
+        for adapter in patterns if checks is not None else []:
+            m = len(adapter)
+            minScore = math.ceil((1 - x) * m - EPS)
+            if minScore <= 0:
+                checks = None
+                break
+            runs |= grams(adapter, min_run(m, minScore))
+        search = finder(runs).search if checks is not None else None
+
+        def screen(lines):
+            # (passes, windows) of every line
+            return [
+                (
+                    search is None
+                    or NOT_ACGT.search(line) is not None
+                    or search(line[::-1]) is not None,
+                    None,
+                )
+                for line in lines
+            ]
+    else:
+        for adapter in patterns if checks is not None else []:
+            m = len(adapter)
+            if args.matcher == 'leven':
+                # Levenshtein.ratio: indel distance over the summed lengths
+                def maxEdits(w, m=m):
+                    return math.floor(x * (m + w) + EPS)
+
+                def cost(q):
+                    return q
+            else:
+                def maxEdits(w, m=m):
+                    return math.floor(x * m + EPS)
+
+                def cost(q):
+                    return q + 1
+            q = args.qgram or best_q(adapter, maxEdits, cost)
+            need = window_hits(m, q, maxEdits, cost(q))
+            if need[m] <= 0:
+                # every window can match (the shorter ones need more hits)
+                checks = None
+                break
+            adapterGrams = grams(adapter, q)
+            checks.append(
+                (m, q, need, finder(adapterGrams).finditer, gram_codes(adapterGrams))
+            )
+
+        def screen(lines):
+            if checks is None:
+                return [(True, None)] * len(lines)
+            if len(lines) == 1:
+                windows = window_mask(lines[0][::-1], checks, args.stop_after)
+                return [(any(map(any, windows)), windows)]
+            masks = window_mask_batch(lines, checks, args.stop_after)
+            passes = masks.any(axis=(0, 2)).tolist()
+            masks = masks.tolist()
+            return [
+                (ok, [mask[i] for mask in masks] if ok else None)
+                for i, ok in enumerate(passes)
+            ]
+
+    find_windows = getattr(match_fun, 'find_windows', None)
+    batch = getattr(match_fun, 'find_batch', None)
+
+    def find_batch(lines):
+        nonlocal rejected, checked
+        lines = [line if isinstance(line, str) else line.decode() for line in lines]
+        matches = [None] * len(lines)
+        if not lines:
+            return matches
+        survivors = [
+            (i, windows) for i, (ok, windows) in enumerate(screen(lines)) if ok
+        ]
+        checked += len(lines)
+        rejected += len(lines) - len(survivors)
+        if batch:
+            values = batch([lines[i] for i, _ in survivors]) if survivors else []
+        elif find_windows:
+            values = [find_windows(lines[i], windows) for i, windows in survivors]
+        else:
+            values = [match_fun.find(lines[i]) for i, _ in survivors]
+        for (i, _), value in zip(survivors, values):
+            matches[i] = value
+        return matches
+
+    def find(line):
+        return find_batch([line])[0]
+
+    def filter_info():
+        return rejected, checked
+
+    match = multi.counted(match_fun.adapters, find, find_batch)
+    match.filter_info = filter_info
+    return match
@@ -6,23 +6,51 @@ import math
 
 from ssw import SSW
 
+from microlib.matcher import multi
 
-def build(adapter, args):
+
+def build(adapters, args):
     '''
     Build a Striped Smith–Waterman matcher with parameters:
       - match_only
+
+    The adapter query profiles are built once, lazily, in the process that
+    uses the matcher (i.e. once per worker) and every read is then aligned
+    against them as the reference; the adapter with the best normalised
+    score wins.
+    The matcher exposes a batch entry point, match.batch(lines), that
+    aligns a whole partition of sequences (str or bytes) per call.
     '''
-    adapter = adapter[:args.match_only][::-1]
+    patterns = [adapter[:args.match_only][::-1] for adapter in adapters]
+    aligners = None
+
+    def get_aligners():
+        nonlocal aligners
+        if aligners is None:
+            aligners = []
+            for adapter in patterns:
+                aligner = SSW(1)
+                aligner.setRead(adapter)
+                aligners.append(aligner)
+        return aligners
 
-    def match(line):
+    def align(matchers, line):
         rline = line[::-1]
-        matcher = SSW(1)
-        matcher.setRead(adapter)
-        matcher.setReference(rline)
-        align = matcher.align()
-                
-        if align.optimal_score/len(adapter) >= 1 - args.max_distance:
-            return -(align.reference_start+len(adapter)) + 1
-        return None
-
-    return match
+        best = None
+        for k, (matcher, adapter) in enumerate(zip(matchers, patterns)):
+            matcher.setReference(rline)
+            align = matcher.align()
+            score = align.optimal_score/len(adapter)
+            if score >= 1 - args.max_distance and (best is None or score > best[0]):
+                best = score, -(align.reference_start+len(adapter)) + 1, k
+        if best is not None:
+            return best[1:]
+
+    def find(line):
+        return align(aligners or get_aligners(), line)
+
+    def find_batch(lines):
+        matchers = aligners or get_aligners()
+        return [align(matchers, line) for line in lines]
+
+    return multi.counted(adapters, find, find_batch)
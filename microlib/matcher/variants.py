@@ -0,0 +1,76 @@
+'''
+Generation and on-disk cache of the k-edit variants of an adapter
+'''
+import hashlib
+import os
+
+BASES = ('A', 'C', 'G', 'T')
+
+
+def neighbours(variant, prefix):
+    '''
+    Yield the variants at one substitution, insertion or deletion from the
+    given one, truncated to prefix bases
+    '''
+    for i, x in enumerate(variant):
+        for base in BASES:
+            if base != x:
+                yield variant[:i] + base + variant[i+1:]
+            # an insertion after the last base is truncated away
+            yield (variant[:i] + base + variant[i:])[:prefix]
+        yield variant[:i] + variant[i+1:]
+
+
+def make_variants(adapter, k, prefix):
+    '''
+    Return the set of the variants of the first prefix bases of the
+    adapter with up to k substitutions, insertions or deletions; the
+    insertions are truncated to prefix bases.
+    Every level is generated only from the variants first found at the
+    previous level, so each variant is expanded once.
+    '''
+    adapter = adapter[:prefix]
+    seen = {adapter}
+    level = [adapter]
+    for _ in range(k):
+        found = set()
+        for variant in level:
+            found.update(neighbours(variant, prefix))
+        found.difference_update(seen)
+        found.discard('')
+        seen.update(found)
+        level = found
+    return seen
+
+
+def cache_path(cacheDir, adapter, k, prefix):
+    key = f'{adapter}\t{k}\t{prefix}'
+    return os.path.join(
+        cacheDir, 'variants-' + hashlib.sha1(key.encode()).hexdigest() + '.txt')
+
+
+def load_variants(adapter, k, prefix, cacheDir):
+    '''
+    Return the sorted list of the k-edit variants of the adapter prefix,
+    loading it from the cache directory if already generated (no cache if
+    cacheDir is empty)
+    '''
+    if not cacheDir:
+        return sorted(make_variants(adapter, k, prefix))
+    path = cache_path(cacheDir, adapter, k, prefix)
+    try:
+        with open(path, 'r') as cached:
+            return cached.read().split()
+    except OSError:
+        pass
+    variants = sorted(make_variants(adapter, k, prefix))
+    try:
+        os.makedirs(cacheDir, exist_ok=True)
+        # write and rename, concurrent runs never see partial files
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as cached:
+            cached.write('\n'.join(variants) + '\n')
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f'Cannot cache the adapter variants: {e}')
+    return variants
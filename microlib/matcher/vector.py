@@ -0,0 +1,84 @@
+'''
+NumPy vectorized mismatch matcher
+'''
+import math
+
+import numpy as np
+
+from microlib.matcher import multi
+
+
+def pack(lines, width):
+    '''
+    Pack a list of sequences (str or bytes) into a 2-D uint8 array,
+    right aligned and padded on the left with zeros
+    '''
+    buf = b"".join(
+        (line.encode("ascii") if isinstance(line, str) else line).rjust(width, b"\0")
+        for line in lines
+    )
+    return np.frombuffer(buf, dtype=np.uint8).reshape(len(lines), width)
+
+
+def build(adapters, args):
+    '''
+    Build a vectorized mismatch matcher with parameters:
+      - match_only
+      - stop_after
+      - max_distance
+
+    The windows are the same as in leven and ndleven, scored with the
+    number of mismatches against every adapter prefix, but only the
+    windows lying entirely inside the read are tried. The matcher exposes
+    match.batch(lines), which scores all the reads and offsets of a
+    partition at once; the adapter with the first hit from the end of the
+    read wins (the first adapter on ties).
+    '''
+    patterns = [
+        np.frombuffer(adapter[:args.match_only].encode("ascii"), dtype=np.uint8)
+        for adapter in adapters
+    ]
+    sizes = [len(adapter) for adapter in patterns]
+    maxErrors = [math.floor(args.max_distance * m) for m in sizes]
+    none = np.iinfo(np.int64).max
+
+    def find_batch(lines):
+        if not lines:
+            return []
+        lengths = np.fromiter((len(line) for line in lines), dtype=np.int64)
+        width = max(int(lengths.max()), max(sizes))
+        reads = pack(lines, width)
+
+        # Distance from the end of the read of the first window matching
+        # every adapter (none if no match)
+        firsts = np.full((len(patterns), len(lines)), none, dtype=np.int64)
+        for a, (adapter, m) in enumerate(zip(patterns, sizes)):
+            # Column c of the scores is the window ending (width - m - c)
+            # bases before the end of every read
+            windows = width - m + 1
+            mismatches = np.zeros((len(lines), windows), dtype=np.int64)
+            for k in range(m):
+                mismatches += reads[:, k:k + windows] != adapter[k]
+            hits = mismatches <= maxErrors[a]
+            # windows ending in the first 1/stop_after of the reversed read
+            # and starting inside the read (not in the padding, so that a
+            # read does not depend on the others of the partition)
+            columns = np.arange(windows)
+            hits &= columns > width - m - lengths[:, None] // args.stop_after
+            hits &= columns >= width - lengths[:, None]
+
+            # The first hit from the end of the read
+            j = np.argmax(hits[:, ::-1], axis=1)
+            firsts[a] = np.where(hits.any(axis=1), j, none)
+
+        winners = np.argmin(firsts, axis=0)
+        j = firsts[winners, np.arange(len(lines))]
+        return [
+            (-(int(first) + sizes[winner]), int(winner)) if first != none else None
+            for first, winner in zip(j, winners)
+        ]
+
+    def find(line):
+        return find_batch([line])[0]
+
+    return multi.counted(adapters, find, find_batch)
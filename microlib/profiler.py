@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import cProfile
+import glob
+import os
+import pstats
+import signal
+from collections import Counter
+from contextlib import contextmanager
+
+SAMPLE_INTERVAL = 0.001
+
+
+class Sampler:
+    """
+    Sampling profiler: every interval seconds of CPU time (SIGPROF) the
+    Python stack of the process is recorded as a collapsed stack, the
+    line of the innermost frame included. The frames above the first one
+    running the root code (if any) are left out.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, root=None):
+        self.interval = interval
+        self.root = root
+        self.stacks = Counter()
+
+    def sample(self, signum, frame):
+        names = [f"{frame.f_code.co_name}:{frame.f_lineno}"]
+        frame = frame.f_back
+        while frame is not None and frame.f_code is not self.root:
+            names.append(frame.f_code.co_name)
+            frame = frame.f_back
+        self.stacks[";".join(reversed(names))] += 1
+
+    def start(self):
+        signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+
+@contextmanager
+def profiling(prefix, role, root=None, mode="sample"):
+    """
+    Profile the block with the sampler, and with cProfile too if mode is
+    "cprofile" (it instruments every call, slowing down the block),
+    saving the results of the process as prefix.role.pid.folded and
+    .prof (nothing is done if prefix is None)
+    """
+    if prefix is None:
+        yield
+        return
+    profiler = cProfile.Profile() if mode == "cprofile" else None
+    sampler = Sampler(root=root)
+    sampler.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        sampler.stop()
+        path = f"{prefix}.{role}.{os.getpid()}"
+        if profiler is not None:
+            profiler.dump_stats(f"{path}.prof")
+        with open(f"{path}.folded", "w") as folded:
+            for stack, count in sampler.stacks.items():
+                folded.write(f"{role};{stack} {count}\n")
+
+
+def profiled(target, prefix, role, mode="sample"):
+    """
+    Wrap a process target to run it under profiling(prefix, role, mode)
+    """
+
+    def run(*args, **kwargs):
+        # the stacks start from the target
+        with profiling(prefix, role, run.__code__, mode):
+            return target(*args, **kwargs)
+
+    return run
+
+
+def merge_profiles(prefix):
+    """
+    Merge the profiles of all the processes in prefix.folded (collapsed
+    stacks for flamegraph.pl, the first frame is the role of the process)
+    and, if profiled with cProfile, prefix.pstats, and remove the per
+    process files. Return the merged stacks (a Counter) and the merged
+    pstats.Stats (None without cProfile).
+    """
+    stacks = Counter()
+    for part in sorted(glob.glob(f"{glob.escape(prefix)}.*.*.folded")):
+        with open(part, "r") as foldedFile:
+            for line in foldedFile:
+                stack, count = line.rstrip("\n").rsplit(" ", 1)
+                stacks[stack] += int(count)
+        os.remove(part)
+    with open(f"{prefix}.folded", "w") as foldedFile:
+        for stack, count in sorted(stacks.items()):
+            foldedFile.write(f"{stack} {count}\n")
+    stats = None
+    parts = sorted(glob.glob(f"{glob.escape(prefix)}.*.*.prof"))
+    if parts:
+        stats = pstats.Stats(*parts)
+        stats.dump_stats(f"{prefix}.pstats")
+        for part in parts:
+            os.remove(part)
+    return stacks, stats
+
+
+def top_lines(stacks, count=15):
+    """
+    Return the count lines (innermost frames) with the most samples, as
+    (frame, samples)
+    """
+    lines = Counter()
+    for stack, samples in stacks.items():
+        lines[stack.rsplit(";", 1)[-1]] += samples
+    return lines.most_common(count)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import math
+import os
+
+from fastqandfurious import fastqandfurious as ff
+from fastqandfurious._fastqandfurious import entrypos as entrypos_c
+
+RANGE_SIZE = 1 << 24
+
+
+class RangeReader:
+    """
+    File-like object reading only the bytes in [start, end) of a file
+    """
+
+    def __init__(self, infile, start, end):
+        self.infile = infile
+        self.left = end - start
+        infile.seek(start)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.left:
+            size = self.left
+        data = self.infile.read(size)
+        self.left -= len(data)
+        return data
+
+
+def record_start(infile, offset):
+    """
+    Return the position of the first FASTQ record starting at or after
+    offset. A record starts with a line beginning with '@', followed by a
+    sequence, a line beginning with '+' and a quality of the same length.
+    """
+    if offset == 0:
+        return 0
+    infile.seek(offset - 1)
+    infile.readline()
+    positions = []
+    lines = []
+    for _ in range(8):
+        positions.append(infile.tell())
+        lines.append(infile.readline())
+    for i in range(4):
+        if (
+            lines[i].startswith(b"@")
+            and lines[i + 2].startswith(b"+")
+            and len(lines[i + 1].rstrip()) == len(lines[i + 3].rstrip())
+        ):
+            return positions[i]
+    return positions[-1]
+
+
+def shard_ranges(inFilePath, shards, rangeSize=RANGE_SIZE):
+    """
+    Split a FASTQ file in (up to) the given number of byte ranges aligned
+    to record boundaries, or more if needed to keep them around rangeSize
+    bytes
+    """
+    size = os.path.getsize(inFilePath)
+    shards = max(shards, math.ceil(size / rangeSize))
+    with open(inFilePath, "rb") as infile:
+        starts = [record_start(infile, size * k // shards) for k in range(shards)]
+    starts = sorted(set(min(start, size) for start in starts)) + [size]
+    return [(a, b) for a, b in zip(starts, starts[1:]) if a < b]
+
+
+def read_range(inFilePath, start, end):
+    """
+    Parse and yield the records in a byte range of a FASTQ file
+    """
+    with open(inFilePath, "rb") as infile:
+        reader = RangeReader(infile, start, end)
+        yield from ff.readfastq_iter(reader, fbufsize=50000, _entrypos=entrypos_c)
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+
+class Stats:
+    """
+    Time spent (seconds) in every stage of a process and counters
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.times = defaultdict(float)
+        self.counts = Counter()
+
+    @contextmanager
+    def timer(self, stage):
+        t_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[stage] += time.perf_counter() - t_start
+
+    def timed(self, stage, iterable):
+        """
+        Yield the items of iterable, adding the time spent waiting for
+        every item to the stage
+        """
+        iterator = iter(iterable)
+        while True:
+            t_start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.times[stage] += time.perf_counter() - t_start
+                return
+            self.times[stage] += time.perf_counter() - t_start
+            yield item
+
+    def count(self, counter, n=1):
+        self.counts[counter] += n
+
+    def report(self, **extra):
+        return dict(
+            name=self.name,
+            ms={stage: round(1000 * t, 3) for stage, t in self.times.items()},
+            counts=dict(self.counts),
+            **extra,
+        )
+
+
+def write_report(statsPath, report):
+    with open(statsPath, "w") as statsFile:
+        json.dump(report, statsFile, indent=2)
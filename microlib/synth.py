@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import random
+
+BASES = "ACGT"
+# no adapter in the read
+NO_CUT = "NA"
+
+
+def mutate(template, cutAt, rand, subRate, insRate, delRate):
+    """
+    Apply substitutions, insertions and deletions to a template sequence
+    and return it with the position in the result of the base cutAt of
+    the template
+    """
+    out = []
+    cut = None
+    for i, base in enumerate(template):
+        if i == cutAt:
+            cut = len(out)
+        r = rand.random()
+        if r < subRate:
+            out.append(rand.choice(BASES.replace(base, "")))
+        elif r < subRate + insRate:
+            out.append(rand.choice(BASES))
+            out.append(base)
+        elif r >= subRate + insRate + delRate:
+            out.append(base)
+    if cut is None:
+        cut = len(out)
+    return "".join(out), cut
+
+
+def simulate(
+    count,
+    adapter,
+    seed=1,
+    readLength=50,
+    readLengthSd=0,
+    insertMean=22,
+    insertSd=3,
+    subRate=0.01,
+    insRate=0.001,
+    delRate=0.001,
+):
+    """
+    Yield count reproducible reads as (name, sequence, quality, cut): a
+    random insert (normal length distribution) followed by the adapter and
+    by random bases, with sequencing errors, cut to a read length (normal
+    distribution). cut is the position of the adapter in the read, None if
+    the insert fills the whole read.
+    """
+    rand = random.Random(seed)
+    for i in range(count):
+        length = max(round(rand.gauss(readLength, readLengthSd)), 1)
+        insertLength = max(round(rand.gauss(insertMean, insertSd)), 0)
+        template = "".join(rand.choice(BASES) for _ in range(insertLength))
+        template += adapter
+        template += "".join(rand.choice(BASES) for _ in range(length))
+        read, cut = mutate(template, insertLength, rand, subRate, insRate, delRate)
+        read = read[:length]
+        yield (
+            b"sim%d" % i,
+            read.encode("ascii"),
+            b"I" * len(read),
+            cut if cut < len(read) else None,
+        )
+
+
+def write_reads(outFile, truthFile, reads):
+    """
+    Write simulated reads to a FASTQ file and their true cut positions to
+    a name<TAB>cut file (both binary), return the number of reads
+    """
+    count = 0
+    for name, read, quality, cut in reads:
+        outFile.write(b"@%b\n%b\n+\n%b\n" % (name, read, quality))
+        value = NO_CUT if cut is None else str(cut)
+        truthFile.write(b"%b\t%b\n" % (name, value.encode()))
+        count += 1
+    return count
+
+
+def read_truth(truthPath):
+    """
+    Return the dict of the true cut positions (None if no adapter) by read
+    name (bytes) of a file written by write_reads
+    """
+    truth = {}
+    with open(truthPath, "rb") as truthFile:
+        for line in truthFile:
+            name, cut = line.rstrip(b"\n").split(b"\t")
+            truth[name] = None if cut == NO_CUT.encode() else int(cut)
+    return truth
+
+
+def cut_position(length, match):
+    """
+    Return the position of the adapter in a read from the match returned
+    by a matcher (a positive position or negative offset from the end)
+    """
+    if not match:
+        return None
+    return match if match > 0 else length + match
+
+
+def score_cuts(lengths, matches, cuts, tolerance=0):
+    """
+    Return the (precision, recall) of the cuts predicted by the matches:
+    a prediction is right if within tolerance bases of the true cut
+    """
+    right = predicted = expected = 0
+    for length, match, cut in zip(lengths, matches, cuts):
+        position = cut_position(length, match)
+        if position is not None:
+            predicted += 1
+        if cut is not None:
+            expected += 1
+            if position is not None and abs(position - cut) <= tolerance:
+                right += 1
+    return right / max(predicted, 1), right / max(expected, 1)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+from multiprocessing import Queue
+from queue import Empty
+
+try:
+    from multiprocessing.shared_memory import SharedMemory
+except ImportError:  # python < 3.8
+    SharedMemory = None
+
+# smallest slot of the shared memory rings
+MIN_SLOT_SIZE = 1 << 16
+# bytes of the separators of a read (its 3 fields) in a packed partition
+SEPARATORS_SIZE = 3
+# the reads of a partition may be this much longer than the sampled ones
+# (e.g. numbered read names)
+HEADROOM = 1.25
+
+
+def slot_size(chunk, sample):
+    """
+    Return the size of the slots holding the partitions of chunk reads,
+    sized from the longest of a sample of reads
+    """
+    longest = max((sum(map(len, seq)) for seq in sample), default=0)
+    size = int(chunk * HEADROOM * (longest + SEPARATORS_SIZE))
+    return max(size, MIN_SLOT_SIZE)
+
+
+class QueueTransport:
+    """
+    Send the partitions through the queues as they are (pickled)
+    """
+
+    def pack(self, partition):
+        return partition
+
+    def unpack(self, message):
+        return message
+
+    def pack_output(self, count, data):
+        return count, data
+
+    def write_output(self, outFile, message):
+        count, data = message
+        outFile.write(data)
+        return count
+
+    def close(self):
+        pass
+
+
+class SharedRing:
+    """
+    Ring of fixed size slots in a shared memory block, the free slots are
+    handed out through a queue
+    """
+
+    def __init__(self, slots, slotSize):
+        self.slotSize = slotSize
+        self.shm = SharedMemory(create=True, size=slots * slotSize)
+        self.free = Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+
+    def put(self, data, block=True):
+        """
+        Copy data in a free slot (waiting for one if block) and return the
+        slot, or None if data does not fit in a slot or no slot is free
+        """
+        if len(data) > self.slotSize:
+            return None
+        try:
+            slot = self.free.get(block)
+        except Empty:
+            return None
+        start = slot * self.slotSize
+        self.shm.buf[start : start + len(data)] = data
+        return slot
+
+    def view(self, slot, size):
+        start = slot * self.slotSize
+        return self.shm.buf[start : start + size]
+
+    def release(self, slot):
+        self.free.put(slot)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class ShmTransport:
+    """
+    Send the partitions through shared memory rings: the fields of the
+    reads of a partition are packed in one buffer, separated by newlines
+    (which FASTQ fields cannot hold), and only the slot descriptors travel
+    over the queues. The slots are sized with slot_size from the chunk
+    size. Partitions that do not fit in a slot (reads longer than the
+    sampled ones) are sent through the queues, as the output of the
+    workers when all the output slots are in use (e.g. waiting in the
+    reorder buffer of the collector).
+    """
+
+    def __init__(self, slots, slotSize):
+        if SharedMemory is None:
+            raise RuntimeError("the shm transport requires python >= 3.8")
+        self.input = SharedRing(slots, slotSize)
+        self.output = SharedRing(slots, slotSize)
+
+    def pack(self, partition):
+        data = b"\n".join([field for seq in partition for field in seq])
+        slot = self.input.put(data)
+        if slot is None:
+            return partition
+        return slot, len(data)
+
+    def unpack(self, message):
+        if isinstance(message, list):
+            return message
+        slot, size = message
+        # one copy out of the slot, split in C
+        with self.input.view(slot, size) as view:
+            fields = bytes(view).split(b"\n")
+        self.input.release(slot)
+        return list(zip(fields[0::3], fields[1::3], fields[2::3]))
+
+    def pack_output(self, count, data):
+        slot = self.output.put(data, block=False)
+        if slot is None:
+            return count, data
+        return count, slot, len(data)
+
+    def write_output(self, outFile, message):
+        if len(message) == 2:
+            count, data = message
+            outFile.write(data)
+            return count
+        count, slot, size = message
+        view = self.output.view(slot, size)
+        outFile.write(view)
+        view.release()
+        self.output.release(slot)
+        return count
+
+    def close(self):
+        self.input.close()
+        self.output.close()
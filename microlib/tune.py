@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import math
+import os
+import time
+from multiprocessing import Queue
+
+from fastqandfurious import fastqandfurious as ff
+from fastqandfurious._fastqandfurious import entrypos as entrypos_c
+
+from .compress import is_gzip, open_input
+
+TUNE_READS = 20000
+# the matching is timed on TUNE_READS reads or for this many seconds
+TUNE_SECONDS = 1.0
+# largest partition timed at once (the budget is checked between them)
+TUNE_CHUNK = 500
+# the fixed cost of the messages of a partition (to a worker and to the
+# collector) may take this fraction of its work
+MAX_OVERHEAD = 0.01
+MIN_CHUNK = 100
+MAX_CHUNK = 20000
+# every worker gets at least this number of partitions (load balance)
+MIN_PARTITIONS = 8
+
+
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def sample_reads(inFilePath, count, ioThreads):
+    """
+    Return the first count reads of a FASTQ file, the seconds spent
+    parsing them and their size in the file (bytes)
+    """
+    with open_input(inFilePath, ioThreads) as infile:
+        t_start = time.perf_counter()
+        sequence = ff.readfastq_iter(infile, fbufsize=50000, _entrypos=entrypos_c)
+        reads = [seq for seq, _ in zip(sequence, range(count))]
+        parse = time.perf_counter() - t_start
+    size = sum(len(c) + 2 * len(s) + 6 for c, s, _ in reads)
+    return reads, parse, size
+
+
+def queue_cost(reads, chunk):
+    """
+    Return the seconds spent sending the reads through a queue (pickling,
+    pipe and unpickling) in one read partitions and in chunk read
+    partitions
+    """
+    q = Queue()
+    costs = []
+    for size in (1, chunk):
+        partitions = [reads[i : i + size] for i in range(0, len(reads), size)]
+        t_start = time.perf_counter()
+        for partition in partitions:
+            q.put(partition)
+            q.get()
+        costs.append(time.perf_counter() - t_start)
+    q.close()
+    return costs
+
+
+def calibrate(
+    inFilePath, process, ioThreads, reads=TUNE_READS, chunk=500, budget=TUNE_SECONDS
+):
+    """
+    Measure on the first reads of the input file the cost (microseconds per
+    read) of parsing, of process (the work of a worker on a partition)
+    and of sending the reads to the workers, and the fixed cost of a
+    message (microseconds per partition). process is timed on the reads
+    it gets through within budget seconds, at most the first reads.
+    """
+    sample, parse, size = sample_reads(inFilePath, reads, ioThreads)
+    n = max(len(sample), 1)
+    step = min(chunk, TUNE_CHUNK)
+    done = 0
+    t_start = time.perf_counter()
+    while done < len(sample) and time.perf_counter() - t_start < budget:
+        partition = sample[done : done + step]
+        process(partition)
+        done += len(partition)
+    work = time.perf_counter() - t_start
+    single, batched = queue_cost(sample[:2000], chunk)
+    m = max(min(len(sample), 2000), 1)
+    # single = m * (message + read), batched = m / chunk * message + m * read
+    message = max(single - batched, 0) / max(m - m / chunk, 1)
+    return {
+        "reads": done,
+        "parse_us": 1e6 * parse / n,
+        "work_us": 1e6 * work / max(done, 1),
+        "send_us": 1e6 * max(batched - m / chunk * message, 0) / m,
+        "message_us": 1e6 * message,
+        "read_bytes": size / n,
+    }
+
+
+def estimate_reads(paths, readBytes):
+    """
+    Estimate the number of reads of the input files from their size, None
+    if any is compressed
+    """
+    if any(is_gzip(path) for path in paths):
+        return None
+    return sum(os.path.getsize(path) for path in paths) / max(readBytes, 1)
+
+
+def choose(costs, cpus, shard=False, totalReads=None):
+    """
+    Choose the number of workers and the chunk size from the costs of
+    calibrate: enough workers to keep up with the reader (up to the free
+    CPUs, 0 for the sequential version on one CPU) and partitions large
+    enough that the messages cost at most MAX_OVERHEAD of the work, while
+    giving every worker MIN_PARTITIONS partitions
+    """
+    if cpus <= 1:
+        workers = 0
+    else:
+        # the reader and the collector share a CPU
+        limit = cpus - 1
+        work = costs["work_us"] + costs["send_us"] / 2
+        if shard:
+            # the workers parse their own byte ranges
+            workers = limit
+        else:
+            reader = costs["parse_us"] + costs["send_us"] / 2
+            workers = min(max(math.ceil(work / max(reader, 1e-3)), 1), limit)
+    chunk = 2 * costs["message_us"] / (MAX_OVERHEAD * max(costs["work_us"], 1e-3))
+    if totalReads is not None and workers > 0:
+        chunk = min(chunk, totalReads / (MIN_PARTITIONS * workers))
+    chunk = min(max(int(round(chunk, -2)), MIN_CHUNK), MAX_CHUNK)
+    return workers, chunk
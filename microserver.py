@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import socketserver
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+from multiprocessing import Process, Queue, Semaphore
+
+import microtrim
+from microlib.compress import open_output
+from microlib.counter import CACHE_DIR
+from microlib.matcher import multi
+from microlib.stats import Stats
+from microlib.transport import QueueTransport
+from microtrim import (
+    EOF,
+    MATCHER_BUILDER,
+    PREFILTERED,
+    WATCH_INTERVAL,
+    WatchedWindow,
+    collector_fun,
+    failed,
+    read_adapters,
+    read_partitions,
+    read_queue,
+    wait_reports,
+    worker_fun,
+    wrap_matcher,
+)
+
+SOCKET_PATH = os.path.join(CACHE_DIR, "server.sock")
+# the options building the matcher of a pool, with the number of workers
+POOL_OPTIONS = (
+    "matcher",
+    "match_only",
+    "edits",
+    "variant_cache",
+    "max_distance",
+    "stop_after",
+    "prefilter",
+    "qgram",
+    "cache_size",
+    "workers",
+)
+# microtrim options a job cannot use (default value)
+UNSUPPORTED = {
+    "aligner": None,
+    "stream": None,
+    "collapse": None,
+    "manifest": None,
+    "shard": False,
+    "transport": "queue",
+    "profile": None,
+    "auto_tune": None,
+}
+PROGRESS_INTERVAL = 0.2
+
+
+class JobParser(argparse.ArgumentParser):
+    """
+    The microtrim parser raising ValueError with the message instead of
+    printing it and exiting (sys.stderr is shared by the job threads)
+    """
+
+    def error(self, message):
+        raise ValueError(message)
+
+    def exit(self, status=0, message=None):
+        raise ValueError(message or "the server only runs jobs")
+
+
+jobParser = JobParser(parents=[microtrim.parser], add_help=False)
+
+parser = argparse.ArgumentParser(
+    description="keep warm microtrim worker pools and trim the jobs sent to a Unix "
+    "socket (see microclient.py)"
+)
+parser.add_argument("--socket", help="path of the Unix socket", default=SOCKET_PATH)
+parser.add_argument(
+    "--max-pools",
+    type=int,
+    help="worker pools kept (one per matcher, adapters, parameters and workers)",
+    default=4,
+)
+
+
+def job_matcher(match_fun):
+    """
+    Rebuild a matcher with its own adapter counters, the matcher (and its
+    cache) stays warm
+    """
+    match = multi.counted(
+        match_fun.adapters, match_fun.find, getattr(match_fun, "find_batch", None)
+    )
+    for name in ("info", "filter_info"):
+        if hasattr(match_fun, name):
+            setattr(match, name, getattr(match_fun, name))
+    return match
+
+
+def pool_worker_fun(control, q1, q2, match_fun, name, statsQueue):
+    """
+    Run worker_fun for every job: the trimming arguments of a job arrive
+    on the control queue of the worker, its partitions on the queue shared
+    by the workers of the pool
+    """
+    transport = QueueTransport()
+    source = partial(read_queue, transport=transport)
+    for trimArgs in iter(control.get, EOF):
+        worker_fun(
+            q1,
+            q2,
+            *trimArgs,
+            job_matcher(match_fun),
+            source,
+            transport,
+            None,
+            name,
+            statsQueue,
+        )
+
+
+class Pool:
+    """
+    Workers forked with a warm matcher, running one job at a time
+    """
+
+    def __init__(self, args):
+        t_start = time.perf_counter()
+        self.workers = args.workers
+        self.matcher = args.matcher
+        adapters = read_adapters(args.adapter)
+        match_fun = wrap_matcher(MATCHER_BUILDER[args.matcher](adapters, args), args)
+        self.lock = threading.Lock()
+        # handlers given the pool (see Server.get_pool) and whether a failed
+        # job left messages in its queues
+        self.users = 0
+        self.broken = False
+        self.q1 = Queue()
+        self.q2 = Queue()
+        self.statsQueue = Queue()
+        self.controls = [Queue() for _ in range(self.workers)]
+        self.process = [
+            Process(
+                target=pool_worker_fun,
+                args=(
+                    control,
+                    self.q1,
+                    self.q2,
+                    match_fun,
+                    f"Worker {i}",
+                    self.statsQueue,
+                ),
+                daemon=True,
+            )
+            for i, control in enumerate(self.controls)
+        ]
+        for p in self.process:
+            p.start()
+        self.build_ms = 1000 * (time.perf_counter() - t_start)
+
+    def run(self, args, outFile, send):
+        """
+        Trim the input file of a job to its (open) output file, calling send
+        with the progress events, return the stats of the reader, the
+        workers and the collector. Raise RuntimeError if the collector or a
+        worker fails, the pool must then be dropped.
+        """
+        transport = QueueTransport()
+        window = Semaphore(4 * self.workers)
+        stats = Stats("Reader")
+        failures = []
+
+        def collect():
+            # outFile is written as the pipe of a run without output file
+            try:
+                collector_fun(
+                    None,
+                    self.q2,
+                    self.workers,
+                    transport,
+                    window,
+                    args.io_threads,
+                    outFile,
+                    statsQueue=self.statsQueue,
+                )
+            except Exception as e:
+                failures.append(f"collector failed: {type(e).__name__}: {e}")
+
+        def check():
+            return failures[0] if failures else failed(self.process)
+
+        for control in self.controls:
+            control.put((args.trim_first, args.trim_last, args.trim_to))
+        collector = threading.Thread(target=collect)
+        collector.start()
+        last = time.perf_counter()
+
+        def progress(count):
+            nonlocal last
+            if time.perf_counter() - last >= PROGRESS_INTERVAL:
+                last = time.perf_counter()
+                send(event="progress", reads=count)
+
+        try:
+            read_partitions(
+                args.in_file,
+                [self.q1],
+                args.chunk,
+                args.debug_limit,
+                transport,
+                WatchedWindow(window, check),
+                args.io_threads,
+                stats=stats,
+                progress=progress,
+            )
+        finally:
+            for _ in range(self.workers):
+                self.q1.put(EOF)
+            # the collector waits for the workers
+            while collector.is_alive() and check() is None:
+                collector.join(WATCH_INTERVAL)
+            if collector.is_alive():
+                # let it stop (and close the output file)
+                for _ in range(self.workers):
+                    self.q2.put(EOF)
+        error = check()
+        if error is not None:
+            raise RuntimeError(error)
+        reports = [stats.report()]
+        return reports + wait_reports(self.statsQueue, self.workers + 1, check)
+
+    def close(self):
+        for control in self.controls:
+            control.put(EOF)
+        for p in self.process:
+            p.join(1)
+            if p.is_alive():
+                p.terminate()
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socketPath, maxPools):
+        super().__init__(socketPath, JobHandler)
+        self.maxPools = maxPools
+        self.pools = OrderedDict()
+        self.poolsLock = threading.Lock()
+
+    def get_pool(self, args):
+        """
+        Return the warm pool of the job (and whether it was warm), building
+        it if needed, and count the handler among its users until
+        release_pool
+        """
+        adapters = tuple(read_adapters(args.adapter))
+        key = (adapters,) + tuple(getattr(args, name) for name in POOL_OPTIONS)
+        with self.poolsLock:
+            warm = key in self.pools
+            if not warm:
+                self.pools[key] = Pool(args)
+            self.pools.move_to_end(key)
+            pool = self.pools[key]
+            pool.users += 1
+            idle = self.evict()
+        for old in idle:
+            old.close()
+        return key, pool, warm
+
+    def release_pool(self, key, pool, broken=False):
+        """
+        Stop counting a handler among the users of the pool, dropping the
+        pool if the job broke it
+        """
+        with self.poolsLock:
+            pool.users -= 1
+            if broken:
+                # the queues of the pool may hold messages of the job
+                pool.broken = True
+                if self.pools.get(key) is pool:
+                    del self.pools[key]
+            idle = self.evict()
+            if pool.broken and not pool.users:
+                idle.append(pool)
+        for old in idle:
+            old.close()
+
+    def evict(self):
+        """
+        Remove the least recently used pools beyond maxPools that no
+        handler uses (called with poolsLock held), return them to be closed
+        """
+        idle = []
+        for old in list(self.pools)[: -self.maxPools]:
+            if not self.pools[old].users:
+                idle.append(self.pools.pop(old))
+        return idle
+
+    def server_close(self):
+        super().server_close()
+        for pool in self.pools.values():
+            pool.close()
+
+
+def parse_job(job):
+    """
+    Parse the microtrim arguments of a job, the paths are relative to the
+    working directory of the client. Raise ValueError with the message of
+    the parser on errors.
+    """
+    args = jobParser.parse_args(job["args"])
+    for name, default in UNSUPPORTED.items():
+        if getattr(args, name) != default:
+            option = name.replace("_", "-")
+            raise ValueError(f"--{option} is not supported by the server")
+    if args.workers < 1:
+        raise ValueError("the server needs at least one worker")
+    if args.prefilter and args.matcher not in PREFILTERED:
+        raise ValueError(f"--prefilter is used only in {', '.join(PREFILTERED)}")
+    cwd = job.get("cwd", os.getcwd())
+    args.in_file = os.path.join(cwd, args.in_file)
+    args.out_file = os.path.join(cwd, args.out_file)
+    # the FASTA files of adapters are relative to the client too
+    args.adapter = [
+        os.path.join(cwd, value) if os.path.isfile(os.path.join(cwd, value)) else value
+        for value in args.adapter
+    ]
+    # raises ValueError on invalid adapters
+    read_adapters(args.adapter)
+    if not os.path.isfile(args.in_file):
+        raise ValueError(f"no input file {args.in_file}")
+    return args
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """
+    Read a job (a JSON line with the microtrim arguments and the working
+    directory of the client) and answer with JSON lines of events: start,
+    progress, then done with the stats or error
+    """
+
+    def send(self, **event):
+        self.wfile.write(json.dumps(event).encode() + b"\n")
+        self.wfile.flush()
+
+    def handle(self):
+        t_start = time.perf_counter()
+        try:
+            job = json.loads(self.rfile.readline())
+        except ValueError:
+            self.send(event="error", message="invalid job")
+            return
+        if job.get("command") == "shutdown":
+            self.send(event="done")
+            threading.Thread(target=self.server.shutdown).start()
+            return
+        try:
+            args = parse_job(job)
+        except ValueError as e:
+            self.send(event="error", message=str(e))
+            return
+        try:
+            outFile = open_output(args.out_file, args.io_threads)
+        except OSError as e:
+            self.send(event="error", message=f"{type(e).__name__}: {e}")
+            return
+        while True:
+            try:
+                key, pool, warm = self.server.get_pool(args)
+            except Exception as e:
+                outFile.close()
+                self.send(event="error", message=f"{type(e).__name__}: {e}")
+                return
+            broken = False
+            try:
+                with pool.lock:
+                    if pool.broken:
+                        # dropped by a failed job while waiting, get another
+                        continue
+                    self.send(
+                        event="start",
+                        warm=warm,
+                        build_ms=0 if warm else pool.build_ms,
+                        start_ms=1000 * (time.perf_counter() - t_start),
+                    )
+                    try:
+                        reports = pool.run(args, outFile, self.send)
+                    except Exception as e:
+                        broken = True
+                        self.send(event="error", message=f"{type(e).__name__}: {e}")
+                        return
+                    break
+            finally:
+                self.server.release_pool(key, pool, broken)
+        matched = [r["counts"] for r in reports if "matched" in r["counts"]]
+        reads = sum(counts["reads"] for counts in matched)
+        self.send(
+            event="done",
+            stats={
+                "matcher": args.matcher,
+                "workers": args.workers,
+                "chunk": args.chunk,
+                "transport": "queue",
+                "shard": False,
+                "matching_ms": 1000 * (time.perf_counter() - t_start),
+                "hit_rate": sum(c["matched"] for c in matched) / max(reads, 1),
+                "processes": reports,
+            },
+        )
+
+
+def main():
+    args = parser.parse_args()
+    os.makedirs(os.path.dirname(os.path.abspath(args.socket)), exist_ok=True)
+    if os.path.exists(args.socket):
+        os.remove(args.socket)
+    server = Server(args.socket, args.max_pools)
+    print(f"Listening on {args.socket}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+
+from microlib.compress import open_output
+from microlib.synth import simulate, write_reads
+
+parser = argparse.ArgumentParser(
+    description="generate a reproducible FASTQ file of microRNA reads with the "
+    "true adapter positions"
+)
+parser.add_argument("-o", "--out-file", help="output FASTQ file (.gz for BGZF)")
+parser.add_argument(
+    "--truth",
+    help="output file of the true cut positions (default OUT_FILE.truth.tsv)",
+)
+parser.add_argument(
+    "-a", "--adapter", help="adapter to insert", default="TGGAATTCTCGGGTGCCAAGG"
+)
+parser.add_argument("--reads", type=int, help="number of reads", default=100000)
+parser.add_argument("--seed", type=int, help="random seed", default=1)
+parser.add_argument("--read-length", type=int, help="mean read length", default=50)
+parser.add_argument(
+    "--read-length-sd", type=float, help="read length standard deviation", default=0
+)
+parser.add_argument(
+    "--insert-mean", type=float, help="mean length before the adapter", default=22
+)
+parser.add_argument(
+    "--insert-sd",
+    type=float,
+    help="standard deviation of the length before the adapter",
+    default=3,
+)
+parser.add_argument(
+    "--sub-rate", type=float, help="substitution rate per base", default=0.01
+)
+parser.add_argument(
+    "--ins-rate", type=float, help="insertion rate per base", default=0.001
+)
+parser.add_argument(
+    "--del-rate", type=float, help="deletion rate per base", default=0.001
+)
+parser.add_argument(
+    "--io-threads",
+    type=int,
+    help="helper processes compressing .gz output (0 inline)",
+    default=2,
+)
+
+
+def main():
+    args = parser.parse_args()
+    if not args.out_file:
+        parser.error("the output file is required")
+    truthPath = args.truth or f"{args.out_file}.truth.tsv"
+    reads = simulate(
+        args.reads,
+        args.adapter,
+        seed=args.seed,
+        readLength=args.read_length,
+        readLengthSd=args.read_length_sd,
+        insertMean=args.insert_mean,
+        insertSd=args.insert_sd,
+        subRate=args.sub_rate,
+        insRate=args.ins_rate,
+        delRate=args.del_rate,
+    )
+    with open_output(args.out_file, args.io_threads) as outFile, open(
+        truthPath, "wb"
+    ) as truthFile:
+        count = write_reads(outFile, truthFile, reads)
+    print(f"Written {count} reads to {args.out_file} and the cuts to {truthPath}")
+
+
+if __name__ == "__main__":
+    main()
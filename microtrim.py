@@ -3,50 +3,120 @@
 
 import argparse
 import math
+import os
 import time
+from collections import Counter
+from functools import partial
+from multiprocessing import Process, Queue, Semaphore
 from queue import Empty
-from multiprocessing import Process, Queue
+from subprocess import TimeoutExpired
 
 from fastqandfurious import fastqandfurious as ff
 from fastqandfurious._fastqandfurious import entrypos as entrypos_c
 
-from microlib.matcher import adaptergen, adaptergen_faster, leven, ndleven, ssw
-from microlib.aligner import bowtie, htseq
+from microlib.matcher import (
+    adaptergen,
+    adaptergen_faster,
+    cache,
+    leven,
+    multi,
+    myers,
+    ndleven,
+    qgram,
+    ssw,
+    vector,
+)
+from microlib.aligner import (
+    bowtie,
+    bowtie_abort,
+    bowtie_count,
+    bowtie_stream,
+    bowtie_wait,
+    count_start,
+    count_wait,
+    htseq,
+)
+from microlib.counter import CACHE_DIR
+from microlib.shard import read_range, shard_ranges
+from microlib.collapse import count_partition, merge_tables, write_collapsed
+from microlib.compress import is_gzip, open_input, open_output, open_sink
+from microlib.transport import QueueTransport, ShmTransport, slot_size
+from microlib.stats import Stats, write_report
+from microlib.profiler import merge_profiles, profiled, profiling, top_lines
+from microlib.tune import (
+    TUNE_READS,
+    TUNE_SECONDS,
+    available_cpus,
+    calibrate,
+    choose,
+    estimate_reads,
+    sample_reads,
+)
 
 MATCHER_BUILDER = {
     "adagen": adaptergen.build,
     "adagen-fast": adaptergen_faster.build,
+    "adagen-ac": adaptergen.build_ac,
+    "adagen-fast-ac": adaptergen_faster.build_ac,
     "leven": leven.build,
     "ndleven": ndleven.build,
+    "myers": myers.build,
     "ssw": ssw.build,
+    "vector": vector.build,
 }
+# approximate matchers supported by the q-gram prefilter
+PREFILTERED = ("leven", "ndleven", "ssw")
 EOF = "EOF"
+SAMPLE_END = "SAMPLE_END"
+ADAPTER_BASES = frozenset("ACGTN")
+FLUSH_SIZE = 1 << 20
+# reads of every input sizing the slots of the shm transport
+SLOT_SAMPLE = 1000
+# seconds between the checks of the other processes while waiting for them
+WATCH_INTERVAL = 0.5
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
     "-m",
     "--matcher",
-    help="the matcher to use [adagen, adagen-fast, leven, ndleven, ssw]",
-    choices=["adagen", "adagen-fast", "leven", "ndleven", "ssw"],
+    help=f"the matcher to use [{', '.join(MATCHER_BUILDER)}]",
+    choices=list(MATCHER_BUILDER),
     required=True,
 )
 parser.add_argument(
     "--aligner",
-    help="select the aligner [bowtie, bowtie_htseq]",
-    choices=["bowtie", "bowtie_htseq"],
+    help="select the aligner [bowtie, bowtie_htseq, bowtie_count]",
+    choices=["bowtie", "bowtie_htseq", "bowtie_count"],
 )
 parser.add_argument(
     "--index",
     help="specify the index file",
     default="data/GCA_000001405.15_GRCh38_no_alt_analysis_set.fna.bowtie_index",
 )
+parser.add_argument(
+    "--stream",
+    help="pipe the trimmed reads into bowtie2 while trimming, writing also the "
+    "output file (tee) or not (pipe)",
+    choices=["tee", "pipe"],
+)
 parser.add_argument("--sam", help="specify the sam file", default="data/eg2.sam")
 parser.add_argument("--gff", help="specify the gff file", default="data/hsa.gff3")
 parser.add_argument(
-    "--count", help="specify the htseq count file", default="data/count.tsv"
+    "--gff-cache",
+    help="directory caching the parsed gff index of bowtie_count (empty disables)",
+    default=CACHE_DIR,
+)
+parser.add_argument(
+    "--count",
+    help="specify the htseq (or bowtie_count) count file",
+    default="data/count.tsv",
 )
 parser.add_argument(
-    "-a", "--adapter", help="adapter to remove", default="TGGAATTCTCGGGTGCCAAGG"
+    "-a",
+    "--adapter",
+    nargs="+",
+    help="adapters to remove (sequences or FASTA files of sequences)",
+    default=["TGGAATTCTCGGGTGCCAAGG"],
 )
 parser.add_argument(
     "--trim-first", type=int, help="number of initial bases to trim", default=0
@@ -71,22 +141,113 @@ parser.add_argument(
 #                     action='store_true')
 # parser.add_argument('-v', '--verbose',
 #                     help='print additional information', action='store_true')
+parser.add_argument(
+    "--edits",
+    type=int,
+    help="generate the adapter variants with up to X substitutions, insertions or "
+    "deletions in the first --match-only bases (used only in the adagen family)",
+)
+parser.add_argument(
+    "--variant-cache",
+    help="directory caching the adapter variants of --edits (empty disables)",
+    default=CACHE_DIR,
+)
 parser.add_argument(
     "--max-distance",
     type=float,
-    help="maximum string distance (used only in ndleven)",
+    help="maximum string distance (used only in ndleven, myers and vector)",
     default=0.1,
 )
 parser.add_argument(
     "--stop-after",
     type=int,
-    help="stop after 1/X of the string (used only in leven and ndleven)",
+    help="stop after 1/X of the string (used only in leven, ndleven, myers and vector)",
     default=2,
 )
+parser.add_argument(
+    "--prefilter",
+    help="skip the reads that cannot match with a q-gram filter (same results, "
+    f"used only in {', '.join(PREFILTERED)})",
+    action="store_true",
+)
+parser.add_argument(
+    "--qgram",
+    type=int,
+    help="length of the q-grams of --prefilter (default the most selective, used "
+    "only in leven and ndleven)",
+)
 parser.add_argument("--workers", type=int, help="number of parallel workers", default=4)
 parser.add_argument(
     "--chunk", type=int, help="number of chunks send to the workers", default=500
 )
+parser.add_argument(
+    "--auto-tune",
+    type=int,
+    nargs="?",
+    const=TUNE_READS,
+    metavar="READS",
+    help="choose --workers and --chunk from the costs measured on the first READS "
+    f"reads of the input (default {TUNE_READS}, or fewer if the matching takes "
+    f"more than {TUNE_SECONDS:g} s)",
+)
+parser.add_argument(
+    "--transport",
+    help="how partitions are sent between processes [queue, shm (python >= 3.8)]",
+    choices=["queue", "shm"],
+    default="queue",
+)
+parser.add_argument(
+    "--dispatch",
+    help="how the reader hands out the partitions: a queue shared by the workers, "
+    "which take the next one when idle, or one queue per worker in turn "
+    "[shared, round-robin]",
+    choices=["shared", "round-robin"],
+    default="shared",
+)
+parser.add_argument(
+    "--shard",
+    help="let every worker parse its own byte ranges of the input file",
+    action="store_true",
+)
+parser.add_argument(
+    "--io-threads",
+    type=int,
+    help="helper processes (de)compressing gzip input and .gz output (0 inline)",
+    default=2,
+)
+parser.add_argument(
+    "--cache-size",
+    type=int,
+    help="cache the matches of the last N distinct reads in every worker (0 disables)",
+    default=0,
+)
+parser.add_argument(
+    "--collapse",
+    help="write each distinct trimmed sequence once with its count [fasta, tsv]",
+    choices=["fasta", "tsv"],
+)
+parser.add_argument(
+    "--manifest",
+    help="trim every input<TAB>output pair of this file with the same workers "
+    "(instead of -i and -o)",
+)
+parser.add_argument(
+    "--stats-json",
+    help="write the time spent in every stage of every process to this JSON file",
+)
+parser.add_argument(
+    "--profile",
+    help="profile the reader, the workers and the collector and write the merged "
+    "samples to PROFILE.folded (collapsed stacks, and PROFILE.pstats with "
+    "--profile-mode cprofile)",
+)
+parser.add_argument(
+    "--profile-mode",
+    help="how --profile profiles: sampling the stacks (low overhead) or also "
+    "instrumenting every call with cProfile (slower) [sample, cprofile]",
+    choices=["sample", "cprofile"],
+    default="sample",
+)
 parser.add_argument(
     "--debug-limit",
     type=int,
@@ -95,72 +256,583 @@ parser.add_argument(
 )
 
 
-def trim_partition(partition, trimFirst, trimLast, trimTo, match_fun):
+def read_adapters(values):
     """
-    Trim a partition of lines with the passed match fun
+    Return the list of distinct adapters given on the command line: every
+    value is an adapter sequence or the path of a FASTA file of adapters.
+    Raise ValueError naming the value if an adapter has bases other than
+    ACGTN (e.g. a mistyped path).
     """
-    for i, seq in enumerate(partition):
-        comment = seq[0].decode("utf-8")
-        line = seq[1].decode("utf-8")
-        quality = seq[2].decode("utf-8")
-        match = match_fun(line)
-        tFirst = 0
-        tLast = 0
-        count = 0
+    adapters = []
+    for value in values:
+        if not os.path.isfile(value):
+            sequences = [value.upper()]
+        else:
+            with open(value, "r") as fasta:
+                sequences = []
+                sequence = []
+                for line in fasta:
+                    line = line.strip()
+                    if line.startswith(">"):
+                        sequences.append("".join(sequence))
+                        sequence = []
+                    else:
+                        sequence.append(line.upper())
+                sequences.append("".join(sequence))
+        for sequence in sequences:
+            if not set(sequence) <= ADAPTER_BASES:
+                raise ValueError(
+                    f"invalid adapter {value}: not a FASTA file nor a sequence of "
+                    "ACGTN"
+                )
+        adapters += sequences
+    return list(dict.fromkeys(adapter for adapter in adapters if adapter))
 
-        if trimTo and match:
-            lineLen = len(line[:match])
-            while lineLen > trimTo:
-                if count % 2:
-                    tFirst += 1
-                else:
-                    tLast += 1
-                count += 1
-                lineLen -= 1
 
-        tFirst = max(tFirst, trimFirst)
-        tLast = max(tLast, trimLast)
+def read_manifest(manifestPath):
+    """
+    Return the list of (input, output) paths of a manifest file, a tab
+    separated pair on every line (empty and # lines are skipped)
+    """
+    samples = []
+    with open(manifestPath, "r") as manifest:
+        for line in manifest:
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) != 2:
+                raise ValueError(f"invalid manifest line: {line.rstrip()}")
+            samples.append((fields[0], fields[1]))
+    return samples
+
+
+def trim_bounds(length, match, trimFirst, trimLast, trimTo):
+    """
+    Return the (start, end) bounds of the part of a read of the given
+    length to keep given the adapter match. The bases exceeding trimTo
+    before the adapter are trimmed alternately from the end and from the
+    start of the read.
+    """
+    if not match:
+        return trimFirst, trimFirst + trimTo
+    excess = 0
+    if trimTo:
+        kept = min(match, length) if match > 0 else max(length + match, 0)
+        excess = max(kept - trimTo, 0)
+    tFirst = max(excess // 2, trimFirst)
+    tLast = max(excess - excess // 2, trimLast)
+    return tFirst, match - tLast
+
+
+def match_lines(lines, match_fun):
+    """
+    Match a list of lines (bytes) with the passed match fun.
+    If the match fun has a batch entry point (match_fun.batch) all the
+    lines are matched in a single call.
+    """
+    batch = getattr(match_fun, "batch", None)
+    if batch:
+        return batch(lines)
+    return [match_fun(line.decode("utf-8")) for line in lines]
+
+
+def format_partition(partition, matches, trimFirst, trimLast, trimTo, out):
+    """
+    Append the FASTQ records of a partition of reads trimmed at their
+    matches to out (a bytearray)
+    """
+    for (comment, line, quality), match in zip(partition, matches):
+        start, end = trim_bounds(len(line), match, trimFirst, trimLast, trimTo)
+        out += b"@%b\n%b\n+\n%b\n" % (comment, line[start:end], quality[start:end])
+    return out
+
+
+def trim_partition(partition, trimFirst, trimLast, trimTo, match_fun, out):
+    """
+    Trim a partition of reads with the passed match fun and append the
+    FASTQ records to out (a bytearray)
+    """
+    matches = match_lines([seq[1] for seq in partition], match_fun)
+    return format_partition(partition, matches, trimFirst, trimLast, trimTo, out)
+
+
+def match_stage(partition, match_fun, stats):
+    """
+    Match a partition of reads counting the time, the reads and the
+    matches in stats
+    """
+    with stats.timer("match"):
+        matches = match_lines([seq[1] for seq in partition], match_fun)
+    stats.count("partitions")
+    stats.count("reads", len(partition))
+    stats.count("matched", sum(1 for match in matches if match))
+    return matches
+
 
+def trim_counts(counts, trimFirst, trimLast, trimTo, match_fun, stats=None):
+    """
+    Trim every distinct line of a table of counts only once and return the
+    table of counts of the trimmed lines. The matched reads (weighted by
+    their counts) are counted in stats, if given.
+    """
+    lines = list(counts)
+    matches = match_lines(lines, match_fun)
+    trimmed = Counter()
+    matched = 0
+    for line, match, count in zip(lines, matches, counts.values()):
+        start, end = trim_bounds(len(line), match, trimFirst, trimLast, trimTo)
+        trimmed[line[start:end]] += count
         if match:
-            line = line[tFirst : match - tLast]
-            quality = quality[tFirst : match - tLast]
-        else:
-            line = line[tFirst : tFirst + trimTo]
-            quality = quality[tFirst : tFirst + trimTo]
+            matched += count
+    if stats is not None:
+        stats.count("matched", matched)
+    return trimmed
+
+
+def iter_partitions(sequence, chunk, debugLimit=-1):
+    """
+    Group the reads in partitions of chunk reads, stopping after the first
+    debugLimit reads if not negative
+    """
+    partition = []
+    for count, seq in enumerate(sequence):
+        if count == debugLimit:
+            break
+        partition.append(seq)
+        if len(partition) == chunk:
+            yield partition
+            partition = []
+    if partition:
+        yield partition
+
+
+def wrap_matcher(matcher, args):
+    """
+    Put the prefilter and the cache of the arguments (if any) around a
+    matcher
+    """
+    if args.prefilter:
+        matcher = qgram.build(matcher, args)
+    if args.cache_size > 0:
+        matcher = cache.build(matcher, args.cache_size)
+    return matcher
+
+
+def print_cache_info(name, match_fun):
+    """
+    Print the hit rate of a cached match fun
+    """
+    if hasattr(match_fun, "info"):
+        hits, misses = match_fun.info()
+        rate = 100 * hits / max(hits + misses, 1)
+        print(f"{name} cache: {hits} hits, {misses} misses ({rate:2.2f}% hit rate)")
+
+
+def print_filter_info(name, match_fun):
+    """
+    Print the reads rejected by a prefiltered match fun
+    """
+    if hasattr(match_fun, "filter_info"):
+        rejected, checked = match_fun.filter_info()
+        rate = 100 * rejected / max(checked, 1)
+        print(
+            f"{name} prefilter: {rejected} of {checked} reads rejected ({rate:2.2f}%)"
+        )
+
+
+def print_adapter_info(name, match_fun, unit="reads"):
+    """
+    Print the number of matches of every adapter, if more than one
+    """
+    if len(match_fun.adapters) > 1:
+        for adapter, hits in match_fun.adapter_hits():
+            print(f"{name} adapter {adapter}: {hits} {unit} matched")
 
-        partition[i] = f"@{comment}\n{line}\n+\n{quality}\n"
-    return partition
 
+def matcher_stats(match_fun):
+    """
+    Return the adapter, cache and prefilter counters of a match fun for the
+    stats
+    """
+    extra = {"adapter_hits": dict(match_fun.adapter_hits())}
+    if hasattr(match_fun, "info"):
+        extra["cache"] = dict(zip(("hits", "misses"), match_fun.info()))
+    if hasattr(match_fun, "filter_info"):
+        extra["prefilter"] = dict(zip(("rejected", "checked"), match_fun.filter_info()))
+    return extra
+
+
+def send_stats(statsQueue, stats, **extra):
+    if statsQueue is not None:
+        statsQueue.put(stats.report(**extra))
+
+
+def read_queue(q1, transport):
+    """
+    Yield the partitions sent by the reader as (key, last, partition)
+    """
+    for index, message in iter(q1.get, EOF):
+        yield (index, 0), True, transport.unpack(message)
+
+
+def read_shards(q1, chunk):
+    """
+    Yield the partitions of the byte ranges of the input files sent by the
+    reader as (key, last, partition)
+    """
+    for index, (inFilePath, start, end) in iter(q1.get, EOF):
+        k = 0
+        previous = []
+        sequence = read_range(inFilePath, start, end)
+        for partition in iter_partitions(sequence, chunk):
+            if k:
+                yield (index, k - 1), False, previous
+            previous = partition
+            k += 1
+        yield (index, max(k - 1, 0)), True, previous
+
+
+def iter_results(q2, workers):
+    """
+    Yield the messages of the workers until all of them sent EOF
+    """
+    eof_count = 0
+    while eof_count < workers:
+        message = q2.get()
+        if message == EOF:
+            eof_count += 1
+            continue
+        yield message
+
+
+def failed(processes, aligner=None):
+    """
+    Return the error message of the first process (or of the streaming
+    aligner, a Popen) that exited with an error, None if none did
+    """
+    # the aligner first, the collector fails writing to it
+    if aligner is not None and aligner.poll():
+        return f"bowtie2 exited with code {aligner.returncode}"
+    for p in processes:
+        if p.exitcode:
+            return f"{p.name} exited with code {p.exitcode}"
+    return None
+
+
+class WatchedWindow:
+    """
+    The window semaphore as acquired by the reader: while waiting it calls
+    check (returning an error message or None) and gives up with
+    RuntimeError on errors, as the collector (or the workers) releasing
+    the window may be gone
+    """
 
-def worker_fun(q1, q2, trimFirst, trimLast, trimTo, match_fun):
-    for p in iter(q1.get, EOF):
-        q2.put(trim_partition(p, trimFirst, trimLast, trimTo, match_fun))
+    def __init__(self, window, check):
+        self.window = window
+        self.check = check
+
+    def acquire(self):
+        while not self.window.acquire(timeout=WATCH_INTERVAL):
+            error = self.check()
+            if error is not None:
+                raise RuntimeError(error)
+
+
+def abort_stream(aligner, counting=None):
+    """
+    Stop the streaming aligner (see bowtie_stream) and its feature
+    counting (see count_start), if any, after a failure of the trimming
+    """
+    bowtie_abort(*aligner)
+    if counting is not None:
+        counting[0].terminate()
+
+
+def wait_reports(statsQueue, count, check):
+    """
+    Return the count stats reports of statsQueue, raising RuntimeError if
+    check returns an error message while waiting
+    """
+    reports = []
+    while len(reports) < count:
+        try:
+            reports.append(statsQueue.get(timeout=WATCH_INTERVAL))
+        except Empty:
+            error = check()
+            if error is not None:
+                raise RuntimeError(error)
+    return reports
+
+
+def join_all(processes, check):
+    """
+    Join the processes, raising RuntimeError if check returns an error
+    message while waiting
+    """
+    for p in processes:
+        while p.is_alive():
+            p.join(WATCH_INTERVAL)
+            error = check()
+            if error is not None:
+                raise RuntimeError(error)
+
+
+def worker_fun(
+    q1,
+    q2,
+    trimFirst,
+    trimLast,
+    trimTo,
+    match_fun,
+    source,
+    transport,
+    window,
+    name="Worker",
+    statsQueue=None,
+):
+    # get: waiting for (and unpacking or parsing) the partitions
+    stats = Stats(name)
+    for key, last, p in stats.timed("get", source(q1)):
+        matches = match_stage(p, match_fun, stats)
+        with stats.timer("format"):
+            out = format_partition(p, matches, trimFirst, trimLast, trimTo, bytearray())
+        with stats.timer("put"):
+            q2.put((key, last, transport.pack_output(len(p), out)))
+    print_cache_info(name, match_fun)
+    print_filter_info(name, match_fun)
+    print_adapter_info(name, match_fun)
+    send_stats(statsQueue, stats, **matcher_stats(match_fun))
     q2.put(EOF)
 
 
-def collector_fun(outFilePath, queues):
-    with open(outFilePath, "w") as outFile:
-        count = 0
-        eof_count = 0
-        while eof_count < len(queues):
-            for q in queues:
-                try:
-                    partition = q.get_nowait()
-                    if partition == EOF:
-                        eof_count += 1
-                        continue
-                    for p in partition:
-                        outFile.write(p)
-                        count += 1
-                except Empty:
-                    pass
+def collector_fun(
+    outFilePath, q2, workers, transport, window, ioThreads, pipe, statsQueue=None
+):
+    """
+    Write the partitions in input order. Every partition has a key
+    (index, k) and the last one of an index has the last flag set: the
+    partitions received out of order wait in a reorder buffer, which is
+    bounded by the window semaphore acquired by the reader for every index
+    and released here once the index is written.
+    """
+    stats = Stats("Collector")
+    pending = {}
+    expected = (0, 0)
+    count = 0
+    with open_sink(outFilePath, ioThreads, pipe) as outFile:
+        for key, last, message in stats.timed("idle", iter_results(q2, workers)):
+            pending[key] = (last, message)
+            while expected in pending:
+                last, message = pending.pop(expected)
+                with stats.timer("write"):
+                    count += transport.write_output(outFile, message)
+                if last:
+                    window.release()
+                    expected = (expected[0] + 1, 0)
+                else:
+                    expected = (expected[0], expected[1] + 1)
+            stats.counts["max_pending"] = max(stats.counts["max_pending"], len(pending))
+    stats.count("reads", count)
     print(f"Received {count} elements")
+    send_stats(statsQueue, stats)
+
+
+def batch_collector_fun(
+    outFilePaths, q2, workers, transport, window, ioThreads, pipe, statsQueue=None
+):
+    """
+    Write the partitions of every sample of a batch to its output file, in
+    input order as in collector_fun. The keys are ((sample, index), k) and
+    the reader sends (SAMPLE_END, sample, indexes) once all the partitions
+    of a sample are sent, the samples are written one after the other.
+    """
+    stats = Stats("Collector")
+    pending = {}
+    sizes = {}
+    sample, index, k = 0, 0, 0
+    outFile = None
+    for message in stats.timed("idle", iter_results(q2, workers)):
+        if message[0] == SAMPLE_END:
+            sizes[message[1]] = message[2]
+        else:
+            key, last, message = message
+            pending[key] = (last, message)
+        while sample < len(outFilePaths):
+            if outFile is None:
+                outFile = open_output(outFilePaths[sample], ioThreads)
+                count = 0
+            if sizes.get(sample) == index:
+                with stats.timer("close"):
+                    outFile.close()
+                outFile = None
+                stats.count("reads", count)
+                print(f"Received {count} elements for {outFilePaths[sample]}")
+                sample, index, k = sample + 1, 0, 0
+                continue
+            if ((sample, index), k) not in pending:
+                break
+            last, message = pending.pop(((sample, index), k))
+            with stats.timer("write"):
+                count += transport.write_output(outFile, message)
+            if last:
+                window.release()
+                index, k = index + 1, 0
+            else:
+                k += 1
+    send_stats(statsQueue, stats)
+
+
+def collapse_worker_fun(
+    q1,
+    q2,
+    trimFirst,
+    trimLast,
+    trimTo,
+    match_fun,
+    source,
+    transport,
+    window,
+    name="Worker",
+    statsQueue=None,
+):
+    stats = Stats(name)
+    counts = Counter()
+    for key, last, p in stats.timed("get", source(q1)):
+        with stats.timer("count"):
+            count_partition(p, counts)
+        stats.count("partitions")
+        stats.count("reads", len(p))
+        if last:
+            window.release()
+    with stats.timer("match"):
+        trimmed = trim_counts(counts, trimFirst, trimLast, trimTo, match_fun, stats)
+    stats.count("distinct", len(counts))
+    with stats.timer("put"):
+        q2.put(trimmed)
+    print_cache_info(name, match_fun)
+    print_filter_info(name, match_fun)
+    print_adapter_info(name, match_fun, "distinct reads")
+    send_stats(statsQueue, stats, **matcher_stats(match_fun))
+    q2.put(EOF)
+
+
+def collapse_collector_fun(
+    outFilePath, q2, workers, transport, window, ioThreads, pipe, fmt, statsQueue=None
+):
+    stats = Stats("Collector")
+    with stats.timer("merge"):
+        counts = merge_tables(stats.timed("idle", iter_results(q2, workers)))
+    with stats.timer("write"):
+        with open_output(outFilePath, ioThreads) as outFile:
+            write_collapsed(outFile, counts, fmt)
+    stats.count("reads", sum(counts.values()))
+    stats.count("distinct", len(counts))
+    print(f"Received {sum(counts.values())} elements, {len(counts)} distinct")
+    send_stats(statsQueue, stats)
+
+
+def read_partitions(
+    inFilePath,
+    queues,
+    chunk,
+    debugLimit,
+    transport,
+    window,
+    ioThreads,
+    sample=None,
+    stats=None,
+    progress=None,
+):
+    """
+    Parse the input file and send it to the workers in partitions of chunk
+    reads, round robin over the queues (all the same queue if shared by
+    the workers). The window semaphore is acquired for every
+    partition. The partitions of a sample of a batch are keyed by (sample,
+    index). progress, if given, is called with the number of reads sent
+    after every partition. Return the number of partitions.
+    """
+    stats = stats or Stats("Reader")
+    with open_input(inFilePath, ioThreads) as infile:
+        count = 0
+        index = -1
+        sequence = ff.readfastq_iter(infile, fbufsize=50000, _entrypos=entrypos_c)
+        partitions = stats.timed("parse", iter_partitions(sequence, chunk, debugLimit))
+        for index, partition in enumerate(partitions):
+            with stats.timer("window"):
+                window.acquire()
+            key = index if sample is None else (sample, index)
+            with stats.timer("put"):
+                queues[index % len(queues)].put((key, transport.pack(partition)))
+            count += len(partition)
+            if progress is not None:
+                progress(count)
+    stats.count("partitions", index + 1)
+    stats.count("reads", count)
+    print(f"Sent {count} elements of {inFilePath} to the workers")
+    return index + 1
+
+
+def send_ranges(shardQueue, inFilePath, shards, window, sample=None, stats=None):
+    """
+    Send the byte ranges of the input file to the workers, which parse
+    them, acquiring the window semaphore for every range. Return the
+    number of ranges.
+    """
+    stats = stats or Stats("Reader")
+    with stats.timer("split"):
+        ranges = shard_ranges(inFilePath, shards)
+    for index, (start, end) in enumerate(ranges):
+        with stats.timer("window"):
+            window.acquire()
+        key = index if sample is None else (sample, index)
+        shardQueue.put((key, (inFilePath, start, end)))
+    stats.count("ranges", len(ranges))
+    print(f"Sent {len(ranges)} byte ranges of {inFilePath} to the workers")
+    return len(ranges)
+
+
+def trim_file(
+    inFilePath,
+    outFilePath,
+    chunk,
+    debugLimit,
+    ioThreads,
+    pipe,
+    trimArgs,
+    match_fun,
+    stats=None,
+):
+    """
+    Trim an input file in the calling process, return the number of reads
+    """
+    stats = stats or Stats("Sequential")
+    count = 0
+    out = bytearray()
+    with open_input(inFilePath, ioThreads) as infile:
+        sequence = ff.readfastq_iter(infile, fbufsize=50000, _entrypos=entrypos_c)
+        with open_sink(outFilePath, ioThreads, pipe) as outFile:
+            partitions = iter_partitions(sequence, chunk, debugLimit)
+            for p in stats.timed("parse", partitions):
+                matches = match_stage(p, match_fun, stats)
+                with stats.timer("format"):
+                    format_partition(p, matches, *trimArgs, out)
+                count += len(p)
+                if len(out) >= FLUSH_SIZE:
+                    with stats.timer("write"):
+                        outFile.write(out)
+                    out.clear()
+            with stats.timer("write"):
+                outFile.write(out)
+    return count
 
 
 def main():
     args = parser.parse_args()
     matcher_name = args.matcher
-    adapter = args.adapter
+    try:
+        adapters = read_adapters(args.adapter)
+    except ValueError as e:
+        parser.error(str(e))
     trimFirst = args.trim_first
     trimLast = args.trim_last
     trimTo = args.trim_to
@@ -169,13 +841,22 @@ def main():
     maxThread = args.workers
     chunk = args.chunk
     debugLimit = args.debug_limit
+    ioThreads = args.io_threads
+    if args.manifest:
+        samples = read_manifest(args.manifest)
+    else:
+        samples = [(inFilePath, outFilePath)]
+    compressed = any(is_gzip(path) for path, _ in samples)
+    shard = args.shard and not compressed
 
     print()
     if trimFirst == 0:
         print(f"Not trimming any initial bases")
     else:
         print(f"Trimming the first {trimFirst} bases")
-    print(f"Trimming adapter: {adapter}")
+    if not adapters:
+        parser.error("no adapter given")
+    print(f"Trimming adapter{'s' if len(adapters) > 1 else ''}: {', '.join(adapters)}")
     # if version == 2:
     print(f"The matcher '{matcher_name}' is used to find the adapter")
     # print(f'Considering only first {matchOnly} bases of adapter: {adapter[:matchOnly]}')
@@ -183,119 +864,374 @@ def main():
     #     print(f'Considering {len(adapters)} possible variants of the adapter')
     # else:
     #     print(f'Using Levenshtein-Damerau distance to find adapter variants')
+    if args.prefilter:
+        if matcher_name not in PREFILTERED:
+            parser.error(f"--prefilter is used only in {', '.join(PREFILTERED)}")
+        print(f"Skipping the reads that cannot match with a q-gram prefilter")
+    if args.cache_size > 0:
+        print(f"Caching the matches of {args.cache_size} distinct reads per worker")
     print(f"Trimming all bases after the adapter (if present)")
     if trimLast == 0:
         print(f"Not trimming any other bases after adapter removal")
     else:
         print(f"Trimming the last {trimLast} bases after adapter removal")
-    print(f"Saving to file: {outFilePath}")
-    print("Used", f"{maxThread} workers" if maxThread > 0 else "sequential version")
-    print()
+    if args.collapse:
+        print(f"Collapsing identical sequences ({args.collapse} with counts)")
+    if compressed:
+        print(f"Decompressing the input with {ioThreads} helper processes")
+    if outFilePath.endswith(".gz"):
+        print(f"Compressing the output (BGZF) with {ioThreads} helper processes")
+    if args.stream:
+        if not args.aligner:
+            parser.error("--stream requires --aligner")
+        if args.collapse:
+            parser.error("--stream cannot be used with --collapse")
+        print(f"Streaming the trimmed reads into bowtie2")
+    if args.collapse and args.aligner:
+        # bowtie2 would align the collapsed sequences and counts as reads
+        parser.error("--collapse cannot be used with --aligner")
+    if args.shard and debugLimit >= 0:
+        # the workers parse whole byte ranges
+        parser.error("--shard cannot be used with --debug-limit")
+    if args.manifest:
+        if args.collapse or args.aligner:
+            parser.error("--manifest cannot be used with --collapse or --aligner")
+        print(f"Trimming the {len(samples)} samples of {args.manifest}")
+    elif args.stream == "pipe":
+        outFilePath = None
+        samples = [(inFilePath, None)]
+    else:
+        print(f"Saving to file: {outFilePath}")
 
     # get the matcher function
     matcher_builder = MATCHER_BUILDER[matcher_name]
-    matcher = matcher_builder(adapter, args)
+    matcher = matcher_builder(adapters, args)
+    tuning = None
+    if args.auto_tune:
+        # time an uncounted copy of the matcher, the adapter hits are untouched
+        tuner = multi.counted(
+            matcher.adapters, matcher.find, getattr(matcher, "find_batch", None)
+        )
+        if args.prefilter:
+            tuner = qgram.build(tuner, args)
+
+        def tune_partition(p):
+            return trim_partition(p, trimFirst, trimLast, trimTo, tuner, bytearray())
+
+        tuning = calibrate(
+            samples[0][0],
+            tune_partition,
+            ioThreads,
+            args.auto_tune,
+            chunk,
+        )
+        totalReads = estimate_reads([path for path, _ in samples], tuning["read_bytes"])
+        if debugLimit >= 0 and not args.manifest:
+            totalReads = min(totalReads or debugLimit, debugLimit)
+        maxThread, chunk = choose(tuning, available_cpus(), shard, totalReads)
+        tuning.update(workers=maxThread, chunk=chunk)
+        print(
+            f"Auto-tune on {tuning['reads']} reads: "
+            f"{tuning['work_us']:.1f} us/read matching and formatting, "
+            f"{tuning['parse_us']:.1f} us/read parsing, "
+            f"{tuning['send_us']:.1f} us/read + {tuning['message_us']:.0f} "
+            "us/partition sending"
+        )
+        print(f"Auto-tune chose: --workers {maxThread} --chunk {chunk}")
+    if shard and maxThread > 0:
+        print(f"Every worker parses its own byte ranges of the input file")
+    elif args.shard and maxThread > 0:
+        print(f"Compressed input: not splitting it in byte ranges")
+    print("Used", f"{maxThread} workers" if maxThread > 0 else "sequential version")
+    print()
+    matcher = wrap_matcher(matcher, args)
+
+    pipe = None
+    counting = None
+    if args.stream:
+        # start the aligner, it reads from the output of the trimming
+        aligner = bowtie_stream(args, sam=args.aligner != "bowtie_count")
+        pipe = aligner[0].stdin
+        if args.aligner == "bowtie_count":
+            counting = count_start(aligner[0], args)
+
+    if args.collapse:
+        worker_target = collapse_worker_fun
+        collector_target = collapse_collector_fun
+        collector_args = (args.collapse,)
+    elif args.manifest:
+        # one output file for every sample
+        worker_target = worker_fun
+        collector_target = batch_collector_fun
+        collector_args = ()
+        outFilePath = [out for _, out in samples]
+    else:
+        worker_target = worker_fun
+        collector_target = collector_fun
+        collector_args = ()
+    if args.profile:
+        worker_target = profiled(
+            worker_target, args.profile, "worker", args.profile_mode
+        )
+        collector_target = profiled(
+            collector_target, args.profile, "collector", args.profile_mode
+        )
 
     if maxThread > 0:
         # build the parallel topology
+        window = Semaphore(4 * maxThread)
+        if args.transport == "shm":
+            # slots for partitions of chunk reads as long as the first ones
+            sample = [
+                seq
+                for path, _ in samples
+                for seq in sample_reads(path, SLOT_SAMPLE, ioThreads)[0]
+            ]
+            transport = ShmTransport(4 * maxThread + 2, slot_size(chunk, sample))
+        else:
+            transport = QueueTransport()
+        if shard:
+            source = partial(read_shards, chunk=chunk)
+            sharedQueue = Queue()
+        else:
+            source = partial(read_queue, transport=transport)
+            # idle workers take the next partition, none waits behind a slow one
+            sharedQueue = Queue() if args.dispatch == "shared" else None
         process = [None] * maxThread
         queues1 = [None] * maxThread
-        queues2 = [None] * maxThread
+        out_queue = Queue()
+        # the workers and the collector send their stats here at the end
+        statsQueue = Queue() if args.stats_json else None
         for i in range(maxThread):
-            queues1[i] = Queue()
-            queues2[i] = Queue()
-            out_queue = queues2[i]
+            queues1[i] = Queue() if sharedQueue is None else sharedQueue
             process[i] = Process(
-                target=worker_fun,
-                args=(queues1[i], out_queue, trimFirst, trimLast, trimTo, matcher),
+                target=worker_target,
+                args=(
+                    queues1[i],
+                    out_queue,
+                    trimFirst,
+                    trimLast,
+                    trimTo,
+                    matcher,
+                    source,
+                    transport,
+                    window,
+                    f"Worker {i}",
+                    statsQueue,
+                ),
+                name=f"Worker {i}",
             )
             process[i].start()
-        collector = Process(target=collector_fun, args=(outFilePath, queues2))
+        collector = Process(
+            target=collector_target,
+            args=(
+                outFilePath,
+                out_queue,
+                maxThread,
+                transport,
+                window,
+                ioThreads,
+                pipe,
+            )
+            + collector_args,
+            kwargs={"statsQueue": statsQueue},
+            name="Collector",
+        )
         collector.start()
+        if pipe is not None:
+            # only the collector writes to the aligner
+            pipe.close()
 
         # start file read
         t_start = time.perf_counter() * 1000
-        with open(inFilePath, "r+b") as infile:
-            t = 0
-            sequence = ff.readfastq_iter(infile, fbufsize=50000, _entrypos=entrypos_c)
-            for i, seq in enumerate(sequence):
-                p = i % chunk
-                if p == 0:
-                    partition = [None] * chunk
-
-                if i == debugLimit:
-                    break
-
-                partition[p] = seq
-
-                if p == chunk - 1:
-                    queues1[t].put(partition)
-                    t = (t + 1) % maxThread
-            if p < chunk - 1:
-                partition = partition[:p]
-                queues1[t].put(partition)
-
-        print(f"Sent {i} elements to the workers")
-        for q in queues1:
-            q.put(EOF)
-
-        print("Wait process")
-        for p in process:
-            p.join()
-        collector.join()
+        stats = Stats("Reader")
+        # the reader gives up when a process (or the aligner) fails
+        check = partial(
+            failed, process + [collector], aligner[0] if args.stream else None
+        )
+        watched = WatchedWindow(window, check)
+        try:
+            with profiling(args.profile, "reader", mode=args.profile_mode):
+                if args.manifest:
+                    # the samples are sent one after the other without waiting for
+                    # the workers, small files are processed concurrently
+                    for sample, (path, _) in enumerate(samples):
+                        if shard:
+                            size = send_ranges(
+                                sharedQueue, path, 4 * maxThread, watched, sample, stats
+                            )
+                        else:
+                            size = read_partitions(
+                                path,
+                                queues1,
+                                chunk,
+                                debugLimit,
+                                transport,
+                                watched,
+                                ioThreads,
+                                sample,
+                                stats,
+                            )
+                        out_queue.put((SAMPLE_END, sample, size))
+                    # the collector must receive all the sizes before the EOFs
+                    out_queue.close()
+                    out_queue.join_thread()
+                elif shard:
+                    # the workers parse the file, send them the byte ranges
+                    send_ranges(
+                        sharedQueue, inFilePath, 4 * maxThread, watched, stats=stats
+                    )
+                else:
+                    read_partitions(
+                        inFilePath,
+                        queues1,
+                        chunk,
+                        debugLimit,
+                        transport,
+                        watched,
+                        ioThreads,
+                        stats=stats,
+                    )
+
+                for q in queues1:
+                    q.put(EOF)
+
+            print("Wait process")
+            reports = [stats.report()]
+            if statsQueue is not None:
+                reports += wait_reports(statsQueue, maxThread + 1, check)
+            join_all(process + [collector], check)
+        except Exception:
+            for p in process + [collector]:
+                p.terminate()
+            if args.stream:
+                abort_stream(aligner, counting)
+            raise
+        finally:
+            transport.close()
         t_end = time.perf_counter() * 1000
         time_match = math.floor(t_end - t_start)
 
+        print(f"Matching time: {time_match}")
+    elif args.collapse:
+        # Sequential collapsed version
+        t_start = time.perf_counter() * 1000
+        stats = Stats("Sequential")
+        with profiling(args.profile, "sequential", mode=args.profile_mode):
+            counts = Counter()
+            with open_input(inFilePath, ioThreads) as infile:
+                sequence = ff.readfastq_iter(
+                    infile, fbufsize=50000, _entrypos=entrypos_c
+                )
+                partitions = iter_partitions(sequence, chunk, debugLimit)
+                for p in stats.timed("parse", partitions):
+                    with stats.timer("count"):
+                        count_partition(p, counts)
+                    stats.count("reads", len(p))
+            with stats.timer("match"):
+                counts = trim_counts(
+                    counts, trimFirst, trimLast, trimTo, matcher, stats
+                )
+            with stats.timer("write"):
+                with open_output(outFilePath, ioThreads) as outFile:
+                    write_collapsed(outFile, counts, args.collapse)
+        reports = [stats.report(**matcher_stats(matcher))]
+
+        t_end = time.perf_counter() * 1000
+        time_match = math.floor(t_end - t_start)
+        print(f"Processed {sum(counts.values())} elements, {len(counts)} distinct")
+        print_cache_info("Sequential", matcher)
+        print_filter_info("Sequential", matcher)
+        print_adapter_info("Sequential", matcher, "distinct reads")
         print(f"Matching time: {time_match}")
     else:
         # Sequential version
         t_start = time.perf_counter() * 1000
-        with open(inFilePath, "r+b") as infile:
-            sequence = ff.readfastq_iter(infile, fbufsize=50000, _entrypos=entrypos_c)
-            with open(outFilePath, "w") as outFile:
-                for i, seq in enumerate(sequence):
-                    comment = seq[0].decode("utf-8")
-                    line = seq[1].decode("utf-8")
-                    quality = seq[2].decode("utf-8")
-                    match = matcher(line)
-                    tFirst = 0
-                    tLast = 0
-                    count = 0
-
-                    if trimTo and match:
-                        lineLen = len(line[:match])
-                        while lineLen > trimTo:
-                            if count % 2:
-                                tFirst += 1
-                            else:
-                                tLast += 1
-                            count += 1
-                            lineLen -= 1
-
-                    tFirst = max(tFirst, trimFirst)
-                    tLast = max(tLast, trimLast)
-
-                    if match:
-                        line = line[tFirst : match - tLast]
-                        quality = quality[tFirst : match - tLast]
-                    else:
-                        line = line[tFirst : tFirst + trimTo]
-                        quality = quality[tFirst : tFirst + trimTo]
-
-                    outFile.write(f"@{comment}\n{line}\n+\n{quality}\n")
+        stats = Stats("Sequential")
+        try:
+            with profiling(args.profile, "sequential", mode=args.profile_mode):
+                count = 0
+                for path, outPath in samples:
+                    count += trim_file(
+                        path,
+                        outPath,
+                        chunk,
+                        debugLimit,
+                        ioThreads,
+                        pipe,
+                        (trimFirst, trimLast, trimTo),
+                        matcher,
+                        stats,
+                    )
+        except Exception:
+            if not args.stream:
+                raise
+            # the writes fail when bowtie2 exits, give it time to report it
+            try:
+                aligner[0].wait(WATCH_INTERVAL)
+            except TimeoutExpired:
+                pass
+            error = failed([], aligner[0])
+            abort_stream(aligner, counting)
+            if error is None:
+                raise
+            raise RuntimeError(error) from None
+        reports = [stats.report(**matcher_stats(matcher))]
 
         t_end = time.perf_counter() * 1000
         time_match = math.floor(t_end - t_start)
-        print(f"Processed {i} elements")
+        print(f"Processed {count} elements")
+        print_cache_info("Sequential", matcher)
+        print_filter_info("Sequential", matcher)
+        print_adapter_info("Sequential", matcher)
         print(f"Matching time: {time_match}")
 
+    if args.profile:
+        stacks, profile = merge_profiles(args.profile)
+        if profile is not None:
+            profile.sort_stats("tottime").print_stats(15)
+            print(f"Profiles written to {args.profile}.pstats")
+        else:
+            total = max(sum(stacks.values()), 1)
+            for frame, samples in top_lines(stacks):
+                print(f"{100 * samples / total:6.2f}% {frame}")
+        print(f"Samples written to {args.profile}.folded")
+
+    if args.stats_json:
+        # reads and matches of the workers (or of the sequential version)
+        matched = [r["counts"] for r in reports if "matched" in r["counts"]]
+        reads = sum(counts["reads"] for counts in matched)
+        write_report(
+            args.stats_json,
+            {
+                "matcher": matcher_name,
+                "workers": maxThread,
+                "chunk": chunk,
+                "transport": args.transport,
+                "shard": shard,
+                "auto_tune": tuning,
+                "matching_ms": time_match,
+                "hit_rate": sum(c["matched"] for c in matched) / max(reads, 1),
+                "processes": reports,
+            },
+        )
+        print(f"Stats written to {args.stats_json}")
+
     # Align results
     if args.aligner:
         print("Start alignment")
 
     # Align results
-    if args.aligner in ("bowtie", "bowtie_htseq"):
+    if args.stream:
+        bowtie_wait(*aligner)
+        if args.aligner == "bowtie_count":
+            count_wait(*counting)
+    elif args.aligner in ("bowtie", "bowtie_htseq"):
+        args.in_file = outFilePath
         bowtie(args)
+    elif args.aligner == "bowtie_count":
+        args.in_file = outFilePath
+        bowtie_count(args)
 
     if args.aligner == "bowtie_htseq":
         htseq(args)
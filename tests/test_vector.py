@@ -0,0 +1,37 @@
+import random
+from types import SimpleNamespace
+
+from microlib.matcher import vector
+
+ADAPTERS = ["TGGAATTCTCGGGTGCCAAGG", "AGATCGGAAGAGC"]
+
+
+def random_reads(count, seed=1):
+    rng = random.Random(seed)
+    reads = []
+    for _ in range(count):
+        read = "".join(rng.choice("ACGT") for _ in range(rng.randint(0, 60)))
+        if rng.random() < 0.5:
+            # a partial adapter at the end of the read
+            adapter = rng.choice(ADAPTERS)
+            read += adapter[: rng.randint(1, len(adapter))]
+        reads.append(read)
+    return reads
+
+
+def test_batch_matches_single_reads():
+    reads = random_reads(2000)
+    for matchOnly, maxDistance, stopAfter in ((15, 0.1, 2), (8, 0.45, 1), (21, 0.3, 3)):
+        args = SimpleNamespace(
+            match_only=matchOnly, max_distance=maxDistance, stop_after=stopAfter
+        )
+        match = vector.build(ADAPTERS, args)
+        assert match.find_batch(reads) == [match.find(read) for read in reads]
+
+
+def test_cut_inside_the_read():
+    args = SimpleNamespace(match_only=8, max_distance=0.45, stop_after=1)
+    match = vector.build(ADAPTERS, args)
+    reads = ["GAATGCT", "ACGT" * 10] + random_reads(500, seed=2)
+    for read, found in zip(reads, match.find_batch(reads)):
+        assert found is None or -found[0] <= len(read)